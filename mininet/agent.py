@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+
+"""
+Mininet node agent: runs commands in a node's namespace on behalf of
+Mininet, speaking a framed protocol on stdin/stdout rather than
+emulating a user at an interactive shell.
+
+Nodes with framed=True start this script (under mnexec) instead of
+bash. Since output arrives in length-prefixed chunks and completion
+is an explicit frame, nothing has to be scanned for prompts or
+markers, and commands may produce arbitrary (binary) output.
+
+Each frame is a one-byte type, a four-byte payload length in network
+byte order, and the payload.
+
+Requests, from Mininet:
+
+C: run a command (payload: command line, run with bash -c)
+D: write payload to the running command's standard input
+I: interrupt the running command (SIGINT to its process group)
+
+Replies, from the agent:
+
+P: command started (payload: its pid, in decimal)
+O: command output, stdout and stderr combined
+X: command exited (payload: exit status, in decimal, 128+N if
+   killed by signal N)
+
+Each command runs in a fresh shell, so shell state such as the
+working directory, variables and job control does not carry over
+from one command to the next. A command completes when its shell
+exits; output written afterwards by processes it left running in
+the background is discarded.
+
+This file must not import anything from mininet, since it is run
+as a standalone script.
+"""
+
+import errno
+import fcntl
+import os
+import select
+import signal
+import struct
+from subprocess import Popen, PIPE, STDOUT
+
+HEADER = '!cI'
+HEADERLEN = struct.calcsize( HEADER )
+
+def packFrame( kind, payload='' ):
+    """Return a frame, ready to send.
+       kind: frame type character
+       payload: string"""
+    return struct.pack( HEADER, kind, len( payload ) ) + payload
+
+def parseFrames( data ):
+    """Split complete frames off the front of data.
+       data: string
+       returns: list of ( type, payload ), remaining data"""
+    frames = []
+    pos = 0
+    while len( data ) - pos >= HEADERLEN:
+        kind, size = struct.unpack_from( HEADER, data, pos )
+        end = pos + HEADERLEN + size
+        if end > len( data ):
+            break
+        frames.append( ( kind, data[ pos + HEADERLEN:end ] ) )
+        pos = end
+    return frames, data[ pos: ]
+
+def retry( fn, *args ):
+    "Call fn( *args ), retrying if interrupted by a signal."
+    while True:
+        try:
+            return fn( *args )
+        except ( IOError, OSError, select.error ), e:
+            if e.args[ 0 ] != errno.EINTR:
+                raise
+
+def setFlag( fd, flag, cmd=( fcntl.F_GETFL, fcntl.F_SETFL ) ):
+    "Set a file status (or, with F_GETFD/F_SETFD, descriptor) flag."
+    fcntl.fcntl( fd, cmd[ 1 ], fcntl.fcntl( fd, cmd[ 0 ] ) | flag )
+
+class Agent( object ):
+    "Command runner for a single node."
+
+    def __init__( self, infd=0, outfd=1 ):
+        self.infd = infd
+        self.outfd = outfd
+        self.inbuf = ''
+        self.child = None  # running command, if any
+        self.childout = None  # its output fd
+        self.orphans = set()  # output fds of completed commands
+        self.poller = select.poll()
+        self.poller.register( infd, select.POLLIN )
+        # SIGCHLD wakes up poll() by writing to a pipe
+        self.sigr, self.sigw = os.pipe()
+        for fd in self.sigr, self.sigw:
+            setFlag( fd, os.O_NONBLOCK )
+            setFlag( fd, fcntl.FD_CLOEXEC, ( fcntl.F_GETFD, fcntl.F_SETFD ) )
+        self.poller.register( self.sigr, select.POLLIN )
+        signal.signal( signal.SIGCHLD, self.sigchld )
+        signal.signal( signal.SIGINT, signal.SIG_IGN )
+
+    def sigchld( self, _signum, _frame ):
+        "Note that a child has exited."
+        try:
+            os.write( self.sigw, 'x' )
+        except OSError:
+            pass
+
+    def send( self, kind, payload='' ):
+        "Send a frame to Mininet."
+        data = packFrame( kind, payload )
+        while data:
+            data = data[ retry( os.write, self.outfd, data ): ]
+
+    def start( self, cmd ):
+        "Start a command."
+        if self.child:
+            # Only one command at a time; report it as failed
+            self.send( 'X', '1' )
+            return
+        self.child = Popen( [ 'bash', '-c', cmd ], stdin=PIPE, stdout=PIPE,
+                            stderr=STDOUT, preexec_fn=self.setupChild )
+        self.childout = self.child.stdout.fileno()
+        setFlag( self.childout, os.O_NONBLOCK )
+        self.poller.register( self.childout, select.POLLIN )
+        self.send( 'P', str( self.child.pid ) )
+
+    @staticmethod
+    def setupChild():
+        "Put command in its own process group, with default signals."
+        os.setpgrp()
+        for sig in signal.SIGINT, signal.SIGPIPE:
+            signal.signal( sig, signal.SIG_DFL )
+
+    def input( self, data ):
+        "Pass data to running command's standard input."
+        if self.child:
+            try:
+                retry( os.write, self.child.stdin.fileno(), data )
+            except OSError:
+                pass
+
+    def interrupt( self ):
+        "Interrupt running command."
+        if self.child:
+            try:
+                os.killpg( self.child.pid, signal.SIGINT )
+            except OSError:
+                pass
+
+    def readOutput( self, fd, forward=True ):
+        """Read available output from fd.
+           forward: send output to Mininet?
+           returns: False at EOF"""
+        while True:
+            try:
+                data = retry( os.read, fd, 65536 )
+            except OSError, e:
+                if e.errno == errno.EAGAIN:
+                    return True
+                raise
+            if not data:
+                self.poller.unregister( fd )
+                self.orphans.discard( fd )
+                if fd == self.childout:
+                    self.childout = None
+                else:
+                    os.close( fd )
+                return False
+            if forward:
+                self.send( 'O', data )
+
+    def reap( self ):
+        "Report completion if our command has exited."
+        try:
+            while os.read( self.sigr, 1024 ):
+                pass
+        except OSError:
+            pass
+        if not self.child or self.child.poll() is None:
+            return
+        if self.childout is not None:
+            self.readOutput( self.childout )
+        if self.childout is not None:
+            # Still held open by background processes
+            orphan = os.dup( self.childout )
+            self.poller.unregister( self.childout )
+            self.poller.register( orphan, select.POLLIN )
+            self.orphans.add( orphan )
+        self.child.stdout.close()
+        self.child.stdin.close()
+        status = self.child.returncode
+        if status < 0:
+            status = 128 - status
+        self.child = self.childout = None
+        self.send( 'X', str( status ) )
+
+    def handle( self, data ):
+        "Handle request data from Mininet."
+        frames, self.inbuf = parseFrames( self.inbuf + data )
+        for kind, payload in frames:
+            if kind == 'C':
+                self.start( payload )
+            elif kind == 'D':
+                self.input( payload )
+            elif kind == 'I':
+                self.interrupt()
+
+    def run( self ):
+        "Serve requests until Mininet closes our input."
+        while True:
+            for fd, _event in retry( self.poller.poll ):
+                if fd == self.infd:
+                    data = retry( os.read, fd, 65536 )
+                    if not data:
+                        return
+                    self.handle( data )
+                elif fd == self.sigr:
+                    self.reap()
+                elif fd == self.childout:
+                    self.readOutput( fd )
+                elif fd in self.orphans:
+                    self.readOutput( fd, forward=False )
+
+if __name__ == '__main__':
+    Agent().run()
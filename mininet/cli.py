@@ -28,12 +28,11 @@ and bandwidth ('iperf'.)
 from subprocess import call
 from cmd import Cmd
 from os import isatty
-from select import poll, POLLIN
 import sys
 
 from mininet.log import info, output, error
 from mininet.term import makeTerms
-from mininet.util import quietRun, isShellBuiltin
+from mininet.util import quietRun, isShellBuiltin, reactor
 
 class CLI( Cmd ):
     "Simple command-line interface to talk to nodes."
@@ -48,8 +47,6 @@ class CLI( Cmd ):
             self.nodemap[ node.name ] = node
         # Attempt to handle input
         self.stdin = stdin
-        self.inPoller = poll()
-        self.inPoller.register( stdin )
         self.inputFile = script
         Cmd.__init__( self )
         info( '*** Starting CLI:\n' )
@@ -356,15 +353,12 @@ class CLI( Cmd ):
 
     def waitForNode( self, node ):
         "Wait for a node to finish, and  print its output."
-        # Pollers
-        nodePoller = poll()
-        nodePoller.register( node.stdout )
-        bothPoller = poll()
-        bothPoller.register( self.stdin )
-        bothPoller.register( node.stdout )
+        inFd, nodeFd = self.stdin.fileno(), node.stdout.fileno()
         while True:
             try:
-                bothPoller.poll()
+                # Don't block if we already have buffered output
+                timeoutms = 0 if node.readbuf else None
+                ready = reactor.poll( [ inFd, nodeFd ], timeoutms )
                 # XXX BL: this doesn't quite do what we want.
                 if False and self.inputFile:
                     key = self.inputFile.read( 1 )
@@ -372,22 +366,13 @@ class CLI( Cmd ):
                         node.write(key)
                     else:
                         self.inputFile = None
-                if isReadable( self.inPoller ):
+                if inFd in ready:
                     key = self.stdin.read( 1 )
                     node.write( key )
-                if isReadable( nodePoller ):
+                if nodeFd in ready or node.readbuf:
                     data = node.monitor()
                     output( data )
                 if not node.waiting:
                     break
             except KeyboardInterrupt:
                 node.sendInt()
-
-# Helper functions
-
-def isReadable( poller ):
-    "Check whether a Poll object has a readable fd."
-    for fdmask in poller.poll( 0 ):
-        mask = fdmask[ 1 ]
-        if mask & POLLIN:
-            return True
@@ -0,0 +1,178 @@
+"""
+Interface and link objects for Mininet.
+
+Intf: an interface of a node, with its name, port number, addresses
+    and link. Uses __slots__, since large networks have very many.
+
+Link: a connection between two interfaces, shared by both of them.
+
+Nodes index their interfaces by name and by port number. The dict-style
+views below present the interfaces as the older per-node dicts (intfs,
+ports, ips, macs and connection), so that code using those keeps
+working. They hold no data of their own, except that ips and macs
+also cache the addresses of interfaces which the node didn't create
+(such as lo, or eth0 in the root namespace), without making Intf
+objects for them.
+"""
+
+from UserDict import DictMixin
+
+class Intf( object ):
+    """An interface of a node.
+       Addresses which haven't been read or set are left unset, so
+       that hasattr( intf, 'ip' ) says whether the address is known."""
+
+    __slots__ = ( 'name', 'node', 'port', 'ip', 'mac', 'link' )
+
+    def __init__( self, name, node, port=None ):
+        """name: interface name (e.g. nodeN-ethM)
+           node: node that owns the interface
+           port: port number, or None"""
+        self.name = name
+        self.node = node
+        self.port = port
+        self.link = None
+
+    def peer( self ):
+        "Return the interface at the other end of our link, or None."
+        if self.link:
+            return self.link.other( self )
+
+    def __repr__( self ):
+        return '<Intf %s>' % self.name
+
+class Link( object ):
+    "A link between two interfaces."
+
+    __slots__ = ( 'intf1', 'intf2' )
+
+    def __init__( self, intf1, intf2 ):
+        """intf1: Intf object
+           intf2: Intf object"""
+        self.intf1 = intf1
+        self.intf2 = intf2
+
+    def other( self, intf ):
+        "Return the interface at the other end of the link from intf."
+        return self.intf2 if intf is self.intf1 else self.intf1
+
+    def __repr__( self ):
+        return '<Link %s<->%s>' % ( self.intf1.name, self.intf2.name )
+
+# Dict-style views of a node's interfaces
+
+class IntfView( DictMixin ):
+    "Base class for views of a node's interfaces."
+
+    def __init__( self, node ):
+        self.node = node
+
+    def clear( self ):
+        "Delete all entries (faster than DictMixin's version.)"
+        for key in self.keys():
+            del self[ key ]
+
+class PortIntfs( IntfView ):
+    "View of a node's interfaces as a dict of port numbers to names."
+
+    def __getitem__( self, port ):
+        return self.node.intfByPort[ port ].name
+
+    def __setitem__( self, port, name ):
+        self.node.setPort( name, port )
+
+    def __delitem__( self, port ):
+        self.node.setPort( self.node.intfByPort[ port ].name, None )
+
+    def __contains__( self, port ):
+        return port in self.node.intfByPort
+
+    def keys( self ):
+        return self.node.intfByPort.keys()
+
+class IntfAttrs( IntfView ):
+    """View of an attribute of a node's interfaces, as a dict of
+       interface names to values. Interfaces for which the attribute
+       is unset are omitted. Values for names the node has no Intf
+       for are kept in other."""
+
+    def __init__( self, node, attr ):
+        IntfView.__init__( self, node )
+        self.attr = attr
+        self.other = {}  # values for interfaces without Intf objects
+
+    def __getitem__( self, name ):
+        intf = self.node.intfByName.get( name )
+        if intf is None:
+            return self.other[ name ]
+        try:
+            return getattr( intf, self.attr )
+        except AttributeError:
+            raise KeyError( name )
+
+    def __setitem__( self, name, value ):
+        intf = self.node.intfByName.get( name )
+        if intf is None:
+            self.other[ name ] = value
+        else:
+            setattr( intf, self.attr, value )
+
+    def __delitem__( self, name ):
+        intf = self.node.intfByName.get( name )
+        if intf is None:
+            del self.other[ name ]
+            return
+        try:
+            delattr( intf, self.attr )
+        except AttributeError:
+            raise KeyError( name )
+
+    def keys( self ):
+        return [ name for name, intf in self.node.intfByName.iteritems()
+                 if hasattr( intf, self.attr ) ] + self.other.keys()
+
+    def adopt( self, intf ):
+        "Move any value kept in other for intf's name onto intf."
+        if intf.name in self.other:
+            setattr( intf, self.attr, self.other.pop( intf.name ) )
+
+class IntfPorts( IntfView ):
+    "View of a node's interfaces as a dict of names to port numbers."
+
+    def __getitem__( self, name ):
+        port = self.node.intfByName[ name ].port
+        if port is None:
+            raise KeyError( name )
+        return port
+
+    def __setitem__( self, name, port ):
+        self.node.setPort( name, port )
+
+    def __delitem__( self, name ):
+        self[ name ]
+        self.node.setPort( name, None )
+
+    def keys( self ):
+        return [ intf.name for intf in self.node.intfByPort.itervalues() ]
+
+class IntfConnections( IntfView ):
+    """View of a node's links as a dict of interface names to
+       ( remote node, remote interface name )."""
+
+    def __getitem__( self, name ):
+        peer = self.node.intfByName[ name ].peer()
+        if peer is None:
+            raise KeyError( name )
+        return peer.node, peer.name
+
+    def __setitem__( self, name, connection ):
+        node, remoteName = connection
+        self.node.registerIntf( name, node, remoteName )
+
+    def __delitem__( self, name ):
+        self[ name ]
+        self.node.unregisterIntf( name )
+
+    def keys( self ):
+        return [ name for name, intf in self.node.intfByName.iteritems()
+                 if intf.link ]
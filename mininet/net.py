@@ -88,15 +88,15 @@ method may be called to shut down the network.
 
 import os
 import re
-import select
 import signal
-from time import sleep
+from time import sleep, time
 
 from mininet.cli import CLI
 from mininet.log import info, error, debug, output
-from mininet.node import Host, Switch, UserSwitch, OVSKernelSwitch, OVSKernelSwitchNew, RemoteSwitch
-from mininet.node import Controller, ControllerParams
-from mininet.util import quietRun, fixLimits
+from mininet.node import Node, Host, Switch, UserSwitch, RemoteSwitch
+from mininet.node import OVSKernelSwitch, OVSKernelSwitchNew, Spawner
+from mininet.node import Controller, ControllerParams, ControllerAddr
+from mininet.util import quietRun, fixLimits, runThreads, RootHelper
 from mininet.util import createLink, macColonHex, ipStr, ipParse
 from mininet.term import cleanUpScreens, makeTerms
 
@@ -108,7 +108,9 @@ class Mininet( object ):
                  cparams=ControllerParams( '10.0.0.0', 8 ),
                  build=True, xterms=False, cleanup=False,
                  inNamespace=False,
-                 autoSetMacs=False, autoStaticArp=False, listenPort=None ):
+                 autoSetMacs=False, autoStaticArp=False, listenPort=None,
+                 parallelSpawn=True, forkServer=False, switchThreads=16,
+                 rootHelper=False ):
         """Create Mininet object.
            topo: Topo (topology) object or None
            switch: Switch class
@@ -122,7 +124,17 @@ class Mininet( object ):
            autoSetMacs: set MAC addrs from topo?
            autoStaticArp: set all-pairs static MAC addrs?
            listenPort: base listening port to open; will be incremented for
-               each additional switch in the net if inNamespace=False"""
+               each additional switch in the net if inNamespace=False
+           parallelSpawn: start all node shells at once when building
+               from topo, rather than waiting for each in turn?
+           forkServer: start the shells of our hosts and switches from
+               a single mnexec fork server, rather than running sudo
+               and mnexec for each?
+           switchThreads: maximum number of switches to start or stop
+               at once
+           rootHelper: if we aren't root, run commands which need root
+               through a single long-lived helper (see RootHelper)
+               rather than running sudo for each?"""
         self.switch = switch
         self.host = host
         self.controller = controller
@@ -134,6 +146,8 @@ class Mininet( object ):
         self.autoSetMacs = autoSetMacs
         self.autoStaticArp = autoStaticArp
         self.listenPort = listenPort
+        self.parallelSpawn = parallelSpawn
+        self.switchThreads = switchThreads
 
         self.hosts = []
         self.switches = []
@@ -142,38 +156,59 @@ class Mininet( object ):
         self.idToNode = {}  # dpid to Node (Host/Switch) objects
         self.dps = 0  # number of created kernel datapaths
         self.terms = []  # list of spawned xterm processes
+        self.buildTimes = {}  # seconds spent in each build phase
+        self.spawner = None  # fork server for node shells, if any
+        self.rootHelper = None  # RootHelper we use, if any
 
+        if rootHelper:
+            self.rootHelper = RootHelper.start()
         init()
         switch.setup()
+        if forkServer:
+            self.spawner = Spawner()
 
         self.built = False
         if topo and build:
             self.build()
 
-    def addHost( self, name, mac=None, ip=None, prefix='h'):
+    def spawnerParams( self ):
+        """Return the parameters telling a new node to use our fork
+           server, if we have one. Nodes only get a spawner parameter
+           when there is one, so host and switch classes which don't
+           take it still work without a fork server."""
+        return { 'spawner': self.spawner } if self.spawner else {}
+
+    def addHost( self, name, mac=None, ip=None, prefix='h', waitStart=True ):
         """Add host.
            name: name of host to add
            mac: default MAC address for intf 0
            ip: default IP address for intf 0
+           waitStart: wait for host's shell to start?
            returns: added host"""
-        host = self.host( name, defaultMAC=mac, defaultIP=ip, prefix=prefix )
+        host = self.host( name, defaultMAC=mac, defaultIP=ip, prefix=prefix,
+                          waitStart=waitStart, **self.spawnerParams() )
         self.hosts.append( host )
         self.nameToNode[ name ] = host
         return host
 
-    def addSwitch( self, name, mac=None, ip=None, prefix='s' ):
+    def addSwitch( self, name, mac=None, ip=None, prefix='s',
+                   waitStart=True ):
         """Add switch.
            name: name of switch to add
            mac: default MAC address for kernel/OVS switch intf 0
+           waitStart: wait for switch's shell to start?
            returns: added switch
            side effect: increments the listenPort member variable."""
         if self.switch == UserSwitch:
             sw = self.switch( name, listenPort=self.listenPort,
-                defaultMAC=mac, defaultIP=ip, inNamespace=self.inNamespace, prefix=prefix )
+                              defaultMAC=mac, defaultIP=ip,
+                              inNamespace=self.inNamespace, prefix=prefix,
+                              waitStart=waitStart, **self.spawnerParams() )
         else:
             sw = self.switch( name, listenPort=self.listenPort,
-                defaultMAC=mac, defaultIP=ip, dp=self.dps,
-                inNamespace=self.inNamespace , prefix=prefix )
+                              defaultMAC=mac, defaultIP=ip, dp=self.dps,
+                              inNamespace=self.inNamespace, prefix=prefix,
+                              waitStart=waitStart, **self.spawnerParams() )
         if not self.inNamespace and self.listenPort:
             self.listenPort += 1
         self.dps += 1
@@ -271,10 +306,13 @@ class Mininet( object ):
         # params were: hosts, ips
         for host in self.hosts:
             hintf = host.intfs[ 0 ]
-            host.setIP( hintf, host.defaultIP, self.cparams.prefixLen )
-            host.setDefaultRoute( hintf )
+            macs = None
+            if self.autoSetMacs and host.defaultMAC:
+                macs = { hintf: host.defaultMAC }
             # You're low priority, dude!
-            quietRun( 'renice +18 -p ' + repr( host.pid ) )
+            host.configure( ips={ hintf: ( host.defaultIP,
+                                           self.cparams.prefixLen ) },
+                            macs=macs, defaultRoute=hintf, priority=18 )
             info( host.name + ' ' )
         info( '\n' )
 
@@ -288,7 +326,8 @@ class Mininet( object ):
             name = prefix + topo.name( nodeId )
             mac = macColonHex( nodeId ) if self.setMacs else None
             ip = topo.ip( nodeId )
-            node = addMethod( name, mac=mac, ip=ip )
+            node = addMethod( name, mac=mac, ip=ip,
+                              waitStart=not self.parallelSpawn )
             self.idToNode[ nodeId ] = node
             info( name + ' ' )
 
@@ -300,6 +339,7 @@ class Mininet( object ):
         info( '*** Adding controller\n' )
         self.addController( 'c0' )
         info( '*** Creating network\n' )
+        start = time()
         info( '*** Adding hosts:\n' )
         for hostId in sorted( topo.hosts() ):
             node_info = topo.node_info [ hostId ]
@@ -312,6 +352,11 @@ class Mininet( object ):
             prefix = switch_info.prefix
             addNode( prefix, self.addSwitch, switchId )
             #addNode( 's', self.addSwitch, switchId )
+        spawned = time()
+        if self.parallelSpawn:
+            info( '\n*** Waiting for node shells to start' )
+            self.waitStarted( self.hosts + self.switches )
+        started = time()
         info( '\n*** Adding links:\n' )
         for srcId, dstId in sorted( topo.edges() ):
             src, dst = self.idToNode[ srcId ], self.idToNode[ dstId ]
@@ -319,6 +364,30 @@ class Mininet( object ):
             createLink( src, dst, srcPort, dstPort )
             info( '(%s, %s) ' % ( src.name, dst.name ) )
         info( '\n' )
+        self.buildTimes.update( spawn=spawned - start,
+                                handshake=started - spawned,
+                                links=time() - started )
+        info( '*** Build times: spawn %(spawn).2fs, '
+              'handshake %(handshake).2fs, links %(links).2fs\n' %
+              self.buildTimes )
+
+    @staticmethod
+    def waitStarted( nodes, timeoutms=30000 ):
+        """Wait for the shells of a set of nodes to start, collecting
+           their PID handshakes from a single poll loop.
+           nodes: list of nodes created with waitStart=False
+           timeoutms: give up if no shell starts for this long (ms)"""
+        pending = set( node for node in nodes if node.pid is None )
+        while pending:
+            ready = Node.pollNodes( pending, timeoutms )
+            if not ready:
+                names = sorted( node.name for node in pending )
+                raise Exception( 'shells did not start within %d ms: %s' %
+                                 ( timeoutms, ' '.join( names ) ) )
+            for node in ready:
+                if node.checkStarted():
+                    pending.remove( node )
+                    info( '.' )
 
     def build( self ):
         "Build mininet."
@@ -331,8 +400,6 @@ class Mininet( object ):
         self.configHosts()
         if self.xterms:
             self.startTerms()
-        if self.autoSetMacs:
-            self.setMacs()
         if self.autoStaticArp:
             self.staticArp()
         self.built = True
@@ -356,7 +423,7 @@ class Mininet( object ):
         """Set MAC addrs to correspond to default MACs on hosts.
            Assume that the host only has one interface."""
         for host in self.hosts:
-            host.setMAC( host.intfs[ 0 ], host.defaultMAC )
+            host.configure( macs={ host.intfs[ 0 ]: host.defaultMAC } )
 
     def staticArp( self ):
         "Add all-pairs ARP entries to remove the need to handle broadcast."
@@ -373,31 +440,72 @@ class Mininet( object ):
         for controller in self.controllers:
             controller.start()
         info( '*** Starting %s switches\n' % len( self.switches ) )
-        for switch in self.switches:
-            info( switch.name + ' ')
-            switch.start( self.controllers )
+        self.startSwitches( self.switches )
         info( '\n' )
 
+    def startSwitches( self, switches ):
+        """Start switches concurrently, using up to switchThreads threads,
+           and return once all of them have started (or failed.)
+           switches: list of switches to start"""
+        controllers = [ ControllerAddr( c ) for c in self.controllers ]
+
+        def start( switch ):
+            "Start a single switch."
+            switch.start( controllers )
+            info( switch.name + ' ' )
+        failures = runThreads( start, switches, self.switchThreads )
+        for switch, e in failures:
+            error( '\n*** Error starting %s: %s\n' % ( switch.name, e ) )
+        if failures:
+            raise Exception( 'Failed to start switches: %s' % ' '.join(
+                switch.name for switch, _e in failures ) )
+
     def stop( self ):
         "Stop the controller(s), switches and hosts"
         if self.terms:
             info( '*** Stopping %i terms\n' % len( self.terms ) )
             self.stopXterms()
         info( '*** Stopping %i hosts\n' % len( self.hosts ) )
+        # Signal every host before reaping any, so that they exit
+        # together, and give them all the same second to do so
+        for host in self.hosts:
+            host.hangup()
+        deadline = time() + 1
         for host in self.hosts:
             info( '%s ' % host.name )
-            host.terminate()
+            host.terminate( max( 0, int( ( deadline - time() ) * 1000 ) ) )
         info( '\n' )
         info( '*** Stopping %i switches\n' % len( self.switches ) )
-        for switch in self.switches:
-            info( switch.name )
-            switch.stop()
+        self.stopSwitches( self.switches )
         info( '\n' )
         info( '*** Stopping %i controllers\n' % len( self.controllers ) )
         for controller in self.controllers:
             controller.stop()
+            controller.terminate()
+        if self.spawner:
+            self.spawner.stop()
+            self.spawner = None
+        if self.rootHelper:
+            RootHelper.stop()
+            self.rootHelper = None
         info( '*** Done\n' )
 
+    def stopSwitches( self, switches ):
+        """Stop and terminate switches concurrently, using up to
+           switchThreads threads. Failures are reported, but don't
+           stop the others from being shut down.
+           switches: list of switches to stop"""
+        def stop( switch ):
+            "Stop a single switch."
+            try:
+                switch.stop()
+            finally:
+                switch.terminate()
+            info( switch.name + ' ' )
+        failures = runThreads( stop, switches, self.switchThreads )
+        for switch, e in failures:
+            error( '\n*** Error stopping %s: %s\n' % ( switch.name, e ) )
+
     def run( self, test, *args, **kwargs ):
         "Perform a complete start/test/stop cycle."
         self.start()
@@ -414,18 +522,17 @@ class Mininet( object ):
            returns: iterator which returns host, line"""
         if hosts is None:
             hosts = self.hosts
-        poller = select.poll()
-        Node = hosts[ 0 ]  # so we can call class method fdToNode
-        for host in hosts:
-            poller.register( host.stdout )
         while True:
-            ready = poller.poll( timeoutms )
-            for fd, event in ready:
-                host = Node.fdToNode( fd )
-                if event & select.POLLIN:
-                    line = host.readline()
-                    if line is not None:
-                        yield host, line
+            if not [ host for host in hosts if host.stdout ]:
+                # No host has output to wait for (e.g. idle LightHosts)
+                return
+            ready = Node.pollNodes( hosts, timeoutms )
+            for host in ready:
+                line = host.readline()
+                # Return any further lines that are already buffered
+                while line is not None:
+                    yield host, line
+                    line = host.readbuf.readline()
             # Return if non-blocking
             if not ready and timeoutms >= 0:
                 yield None, None
@@ -460,7 +567,8 @@ class Mininet( object ):
             output( '%s -> ' % node.name )
             for dest in hosts:
                 if node != dest:
-                    result = node.cmd( 'ping -c1 -W 1 ' + dest.IP() )
+                    result = node.cmd( 'ping -c1 -W 1 ' + dest.IP(),
+                                       timeoutms=5000 )
                     sent, received = self._parsePing( result )
                     packets += sent
                     if received > sent:
@@ -501,14 +609,13 @@ class Mininet( object ):
             error( 'could not parse iperf output: ' + iperfOutput )
             return ''
 
-    def iperf( self, hosts=None, l4Type='TCP', udpBw='10M' ):
+    def iperf( self, hosts=None, l4Type='TCP', udpBw='10M',
+               timeoutms=10000 ):
         """Run iperf between two hosts.
            hosts: list of hosts; if None, uses opposite hosts
            l4Type: string, one of [ TCP, UDP ]
+           timeoutms: how long to wait for the server to start
            returns: results two-element array of server and client speeds"""
-        if not quietRun( 'which telnet' ):
-            error( 'Cannot find telnet in $PATH - required for iperf test' )
-            return
         if not hosts:
             hosts = [ self.hosts[ 0 ], self.hosts[ -1 ] ]
         else:
@@ -525,18 +632,17 @@ class Mininet( object ):
         elif l4Type != 'TCP':
             raise Exception( 'Unexpected l4 type: %s' % l4Type )
         server.sendCmd( iperfArgs + '-s', printPid=True )
-        servout = ''
-        while server.lastPid is None:
-            servout += server.monitor()
-        while 'Connected' not in client.cmd(
-            'sh -c "echo A | telnet -e A %s 5001"' % server.IP()):
-            output('waiting for iperf to start up')
-            sleep(.5)
+        index, _match, servout = server.expect( 'Server listening',
+                                                timeoutms=timeoutms )
+        if index is None:
+            if server.waiting:
+                servout += server.interrupt()
+            error( 'iperf server failed to start: %s\n' % servout )
+            return
         cliout = client.cmd( iperfArgs + '-t 5 -c ' + server.IP() + ' ' +
-                           bwArgs )
+                           bwArgs, timeoutms=30000 )
         debug( 'Client output: %s\n' % cliout )
-        server.sendInt()
-        servout += server.waitOutput()
+        servout += server.interrupt()
         debug( 'Server output: %s\n' % servout )
         result = [ self._parseIperf( servout ), self._parseIperf( cliout ) ]
         if l4Type == 'UDP':
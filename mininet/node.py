@@ -13,6 +13,10 @@ Host: a virtual host. By default, a host is simply a shell; commands
     monitor(). Examples of how to run experiments using this
     functionality are provided in the examples/ directory.
 
+LightHost: a host without a persistent shell, which only holds a network
+    namespace and runs each command in a new shell on demand. Useful for
+    topologies with very many hosts.
+
 Switch: superclass for switch nodes.
 
 UserSwitch: a switch using the user-space switch from the OpenFlow
@@ -55,77 +59,237 @@ Future enhancements:
 import os
 import pty
 import re
+import shlex
 import signal
-import select
 import sys
+from heapq import heappop, heappush
+from pipes import quote
 from subprocess import Popen, PIPE, STDOUT
-from time import sleep
+from time import sleep, time
+from weakref import WeakValueDictionary
 
+from mininet.link import Intf, Link, PortIntfs, IntfPorts, IntfAttrs
+from mininet.link import IntfConnections
 from mininet.log import info, error, debug
 from mininet.util import quietRun, makeIntfPair, moveIntf, isShellBuiltin
+from mininet.util import deleteLink, deleteLinks, killProcess, rootCmd
+from mininet.util import childProcesses, intfInRoot
+from mininet.util import ReadBuffer, WaitFd, reactor
+from mininet.agent import packFrame, parseFrames
 from mininet.moduledeps import moduleDeps, pathCheck, checkRunning, OVS_KMOD, OF_KMOD, TUN
 
 SWITCH_PORT_BASE = 1  # For OF > 0.9, switch ports start at 1 rather than zero
 
+class Spawner( object ):
+    """Fork server (mnexec -f) which starts node shells, so that we
+       run sudo and mnexec once rather than once per node. We open each
+       node's pty ourselves and pass the server the slave's path."""
+
+    def __init__( self ):
+        # The server must not inherit other nodes' pty masters, or
+        # closing them would no longer hang up those nodes' shells
+        self.popen = Popen( rootCmd( [ 'mnexec', '-c', '-f' ] ),
+                            stdin=PIPE, stdout=PIPE, close_fds=True )
+
+    def spawn( self, tty, inNamespace=True ):
+        """Start a shell on a pty.
+           tty: path of pty slave
+           inNamespace: start shell in a new network namespace?
+           returns: pid of shell, or None if we failed"""
+        try:
+            self.popen.stdin.write( '%s %s\n' %
+                                    ( 'n' if inNamespace else '-', tty ) )
+            self.popen.stdin.flush()
+            return int( self.popen.stdout.readline() ) or None
+        except ( IOError, OSError, ValueError ):
+            return None
+
+    def stop( self ):
+        "Shut down the server; shells it started are unaffected."
+        self.popen.stdin.close()
+        self.popen.wait()
+        self.popen.stdout.close()
+
 class Node( object ):
     """A virtual network node is simply a shell in a network namespace.
        We communicate with it using pipes."""
 
-    inToNode = {}  # mapping of input fds to nodes
-    outToNode = {}  # mapping of output fds to nodes
+    # Mappings of input and output fds to nodes. These are weak, so
+    # that they don't keep nodes alive; nodes remove themselves in
+    # cleanup() anyway, since their fds may be re-used.
+    inToNode = WeakValueDictionary()
+    outToNode = WeakValueDictionary()
+    reactor = reactor  # readiness multiplexer shared by all nodes
 
     portBase = 0  # Nodes always start with eth0/port0, even in OF 1.0
 
+    # If inlineMarker is set, sendCmd() prefixes each command with a
+    # printf of a numbered start marker (and runs the command with eval),
+    # so that sending a command takes a single write and round trip;
+    # monitor() discards any stale output that precedes the marker.
+    # Otherwise, sendCmd() first round-trips an echoed sentinel to flush
+    # stale output (see flushOutput().)
+    inlineMarker = True
+
+    # If framed is set, the node runs mininet/agent.py rather than an
+    # interactive shell, and we exchange length-prefixed frames with
+    # it over pipes. Output is binary-safe and needs no scanning for
+    # prompts or markers, but each command runs in a fresh shell.
+    framed = False
+
+    # IP() and MAC() read an interface's addresses from the node until
+    # it has them, and then return them from the ips and macs caches,
+    # which setIP(), setMAC() and configure() keep up to date. If
+    # addresses may be changed behind our back (e.g. by running
+    # ifconfig), call invalidateAddrs(), or set rereadAddrs to read
+    # them from the node every time.
+    rereadAddrs = False
+
     def __init__( self, name, inNamespace=True,
-        defaultMAC=None, defaultIP=None, prefix='n', **kwargs ):
+        defaultMAC=None, defaultIP=None, prefix='n', waitStart=True,
+        spawner=None, **kwargs ):
         """name: name of node
            inNamespace: in network namespace?
            defaultMAC: default MAC address for intf 0
-           defaultIP: default IP address for intf 0"""
+           defaultIP: default IP address for intf 0
+           waitStart: wait for shell to start? If False, call
+               waitStarted() or checkStarted() later
+           spawner: Spawner to start our shell, or None to start it
+               with sudo and mnexec ourselves"""
         self.name = name
+        self.spawner = spawner
         self.inNamespace = inNamespace
         self.defaultIP = defaultIP
         self.defaultMAC = defaultMAC
         self.prefix = prefix
-        opts = '-cdp'
+        self.intfByName = {}  # dict of interface names to Intf objects
+        self.intfByPort = {}  # dict of port numbers to Intf objects
+        # Dict-style views of our interfaces (see mininet.link)
+        self.intfs = PortIntfs( self )  # port numbers to interface names
+        self.ports = IntfPorts( self )  # interface names to port numbers
+        self.ips = IntfAttrs( self, 'ip' )  # interface names to IP addresses
+        self.macs = IntfAttrs( self, 'mac' )  # interface names to MACs
+        self.connection = IntfConnections( self )  # names to remote
+                                                   # ( node, intf name )
+        self.peers = {}  # dict of remote nodes to lists of our Intfs
+        self.nextPort = self.portBase  # lowest never-used port number
+        self.freePorts = []  # heap of freed port numbers (may be stale)
+        self.execed = False
+        self.lastCmd = None
+        self.lastPid = None
+        self.readbuf = ReadBuffer()
+        self.waiting = False
+        self.serial = 0
+        self.marker = None  # start marker we are waiting for, if any
+        self.stale = ''  # output received before our start marker
+        self.pid = None
+        self.pidbuf = ''
+        self.shell = None  # Popen object for our shell, if we started it
+        self.terminated = False  # has hangup() or terminate() been called?
+        self.slave = None  # our copy of our pty's slave fd, until started
+        self.framebuf = ''  # partial frame from agent, if framed
+        self.lastStatus = None  # exit status of last command, if framed
+        # Stash additional information as desired
+        self.args = kwargs
+        self.startShell()
+        if waitStart:
+            self.waitStarted()
+
+    def startShell( self ):
+        "Start a shell process for running commands."
+        # -p last: the pid is what we use to place interfaces in our
+        # namespace, so it must only be printed once we are in it
+        opts = '-cd'
         if self.inNamespace:
             opts += 'n'
-        cmd = [ 'sudo', '-E', 'env', 'PATH=%s' % os.environ['PATH'],
-                'PS1=' + chr( 127 ), 'mnexec', opts, 'bash', '--norc' ]
+        opts += 'p'
+        if self.framed:
+            agent = os.path.join(
+                os.path.dirname( os.path.abspath( __file__ ) ), 'agent.py' )
+            cmd = rootCmd( [ 'mnexec', opts, sys.executable, agent ] )
+            self.shell = Popen( cmd, stdin=PIPE, stdout=PIPE, close_fds=False )
+            self.stdin = self.shell.stdin
+            self.stdout = self.shell.stdout
+            self.outToNode[ self.stdout.fileno() ] = self
+            self.inToNode[ self.stdin.fileno() ] = self
+            return
+        cmd = rootCmd( [ 'env', 'PS1=' + chr( 127 ),
+                         'mnexec', opts, 'bash', '--norc' ] )
         # Spawn a shell subprocess in a pseudo-tty, to disable buffering
         # in the subprocess and insulate it from signals (e.g. SIGINT)
         # received by the parent
         master, slave = pty.openpty()
-        self.shell = Popen( cmd, stdin=slave, stdout=slave, stderr=slave,
-            close_fds=False )
+        # We keep the slave open until the shell has started: if all
+        # its fds were closed before the shell opened it, reading the
+        # master would fail
+        self.slave = slave
+        if self.spawner and self.spawner.spawn( os.ttyname( slave ),
+                                                self.inNamespace ):
+            self.shell = None
+        else:
+            self.shell = Popen( cmd, stdin=slave, stdout=slave, stderr=slave,
+                close_fds=False )
         self.stdin = os.fdopen( master )
         self.stdout = self.stdin
-        self.pollOut = select.poll()
-        self.pollOut.register( self.stdout )
         # Maintain mapping between file descriptors and nodes
         # This is useful for monitoring multiple nodes
-        # using select.poll()
+        # using pollNodes()
         self.outToNode[ self.stdout.fileno() ] = self
         self.inToNode[ self.stdin.fileno() ] = self
-        self.intfs = {}  # dict of port numbers to interface names
-        self.ports = {}  # dict of interface names to port numbers
-                         # replace with Port objects, eventually ?
-        self.ips = {}  # dict of interfaces to ip addresses as strings
-        self.macs = {}  # dict of interfacesto mac addresses as strings
-        self.connection = {}  # remote node connected to each interface
-        self.execed = False
-        self.lastCmd = None
-        self.lastPid = None
-        self.readbuf = ''
-        self.waiting = False
-        # Stash additional information as desired
-        self.args = kwargs
-        x = ""
-        while "\n" not in x:
-            self.waitReadable()
-            x += self.read(1)
-        self.pid = int(x[1:-1])
-        self.serial = 0
+
+    def checkStarted( self ):
+        """Consume the shell's PID banner (^A + pid, printed by mnexec -p.)
+           Call when our output is readable. Anything following the
+           banner is kept in readbuf for subsequent reads.
+           returns: True if the shell has started"""
+        if self.pid is None:
+            self.pidbuf += os.read( self.stdout.fileno(), 1024 )
+            start = self.pidbuf.find( chr( 1 ) )
+            end = self.pidbuf.find( '\n', start )
+            if start >= 0 and end >= 0:
+                self.pid = int( self.pidbuf[ start + 1 : end ] )
+                if self.framed:
+                    self.framebuf = self.pidbuf[ end + 1: ]
+                else:
+                    self.readbuf.append( self.pidbuf[ end + 1: ] )
+                self.pidbuf = ''
+                self.closeSlave()
+        return self.pid is not None
+
+    def closeFiles( self ):
+        "Close our input and output files, and forget their fds."
+        for f in set( [ self.stdin, self.stdout ] ):
+            if f is None:
+                continue
+            fd = f.fileno()
+            for fdToNode in self.inToNode, self.outToNode:
+                if fdToNode.get( fd ) is self:
+                    del fdToNode[ fd ]
+            self.reactor.forget( fd )
+            f.close()
+        self.stdin = self.stdout = None
+
+    def closeSlave( self ):
+        "Close our copy of our pty's slave fd, if we have one."
+        if self.slave is not None:
+            os.close( self.slave )
+            self.slave = None
+
+    def waitStarted( self, timeoutms=30000 ):
+        """Wait for our shell to start.
+           timeoutms: timeout in ms or None to wait indefinitely
+           returns: pid of shell"""
+        deadline = None if timeoutms is None else time() + timeoutms / 1000.0
+        while self.pid is None:
+            if deadline is None:
+                self.waitReadable()
+            else:
+                remaining = int( ( deadline - time() ) * 1000 )
+                if remaining <= 0 or not self.waitReadable( remaining ):
+                    raise Exception( '%s: shell did not start within %d ms' %
+                                     ( self.name, timeoutms ) )
+            self.checkStarted()
+        return self.pid
 
     @classmethod
     def fdToNode( cls, fd ):
@@ -135,46 +299,153 @@ class Node( object ):
         node = Node.outToNode.get( fd )
         return node or Node.inToNode.get( fd )
 
-    def cleanup( self ):
-        "Help python collect its garbage."
-        self.shell = None
+    @classmethod
+    def pollNodes( cls, nodes, timeoutms=None ):
+        """Wait until any of a set of nodes has output to read.
+           nodes: list of nodes
+           timeoutms: timeout in ms, or None/negative to wait indefinitely
+           returns: list of readable nodes (empty at once if none of
+               them has any output to wait for)"""
+        # Nodes without output to wait for (e.g. an idle LightHost)
+        # are skipped
+        fds = [ node.stdout.fileno() for node in nodes if node.stdout ]
+        if not fds:
+            return []
+        return [ cls.fdToNode( fd ) for fd in cls.reactor.poll( fds,
+                                                                timeoutms ) ]
+
+    def cleanup( self, timeoutms=1000 ):
+        """Release our resources: close our fds (which hangs up our
+           shell, if it is on a pty), and reap our shell if we
+           started it.
+           timeoutms: how long to wait for our shell to exit before
+               killing it"""
+        self.closeFiles()
+        self.closeSlave()
+        if self.shell:
+            deadline = time() + timeoutms / 1000.0
+            while self.shell.poll() is None and time() < deadline:
+                sleep( .001 )
+            if self.shell.returncode is None:
+                killProcess( self.pid or self.shell.pid, signal.SIGKILL )
+                self.shell.wait()
+            self.shell = None
 
     # Subshell I/O, commands and control
     def read( self, bytes=1024 ):
         """Buffered read from node, non-blocking.
+           Returns buffered output if there is any; otherwise reads
+           from the node, so call when the node is readable.
            bytes: maximum number of bytes to return"""
-        count = len( self.readbuf )
-        if count < bytes:
-            data = os.read( self.stdout.fileno(), bytes - count )
-            self.readbuf += data
-        if bytes >= len( self.readbuf ):
-            result = self.readbuf
-            self.readbuf = ''
-        else:
-            result = self.readbuf[ :bytes ]
-            self.readbuf = self.readbuf[ bytes: ]
-        return result
+        if not self.readbuf:
+            if not self.framed:
+                return os.read( self.stdout.fileno(), bytes )
+            self.readFrames()
+        return self.readbuf.read( bytes )
+
+    def readFrames( self ):
+        """Read frames from our agent, appending command output to
+           readbuf. Call when the node is readable."""
+        frames, self.framebuf = parseFrames(
+            self.framebuf + os.read( self.stdout.fileno(), 65536 ) )
+        for kind, payload in frames:
+            if kind == 'O':
+                self.readbuf.append( payload )
+            elif kind == 'P':
+                self.lastPid = int( payload )
+            elif kind == 'X':
+                self.lastStatus = int( payload )
+                self.waiting = False
+
+    def writeFrame( self, kind, payload='' ):
+        """Send a frame to our agent.
+           kind: frame type character
+           payload: string"""
+        data = packFrame( kind, payload )
+        while data:
+            data = data[ os.write( self.stdin.fileno(), data ): ]
 
     def readline( self ):
         """Buffered readline from node, non-blocking.
            returns: line (minus newline) or None"""
-        self.readbuf += self.read( 1024 )
-        if '\n' not in self.readbuf:
-            return None
-        pos = self.readbuf.find( '\n' )
-        line = self.readbuf[ 0 : pos ]
-        self.readbuf = self.readbuf[ pos + 1: ]
+        line = self.readbuf.readline()
+        if line is None:
+            if self.framed:
+                self.readFrames()
+            else:
+                self.readbuf.append( os.read( self.stdout.fileno(), 1024 ) )
+            line = self.readbuf.readline()
         return line
 
+    def popen( self, *args, **kwargs ):
+        """Start a process in our network namespace, independently of
+           our shell, so that it has its own pipes and exit status.
+           Unlike sendCmd(), any number of these may run at once.
+           args: command and arguments, as a list or string (which is
+               split into arguments as the shell would, with shlex)
+           cpus: run on these cpus (list, or string such as '0,2-3')
+           cgroup: run in this cgroup (directory in a cgroup filesystem)
+           kwargs: other Popen() options (stdout/stderr piped by default)
+           returns: Popen object (note: pid is that of sudo)"""
+        if self.pid is None:
+            self.waitStarted()
+        cpus = kwargs.pop( 'cpus', None )
+        cgroup = kwargs.pop( 'cgroup', None )
+        cmd = args
+        if len( args ) == 1:
+            cmd = args[ 0 ]
+            if isinstance( cmd, str ):
+                cmd = shlex.split( cmd )
+        # mnexec closes inherited fds much faster than Popen( close_fds )
+        mncmd = [ 'mnexec', '-c' ]
+        if self.inNamespace:
+            mncmd += [ '-a', str( self.pid ) ]
+        if cpus is not None:
+            if not isinstance( cpus, str ):
+                cpus = ','.join( str( cpu ) for cpu in cpus )
+            mncmd += [ '-s', cpus ]
+        if cgroup:
+            mncmd += [ '-g', cgroup ]
+        cmd = rootCmd( mncmd + list( cmd ) )
+        params = { 'stdout': PIPE, 'stderr': PIPE }
+        params.update( kwargs )
+        return Popen( cmd, **params )
+
+    def pexec( self, *args, **kwargs ):
+        """Run a process in our network namespace with popen() and wait
+           for it to complete.
+           returns: stdout, stderr, exit status"""
+        popen = self.popen( *args, **kwargs )
+        out, err = popen.communicate()
+        return out, err, popen.returncode
+
     def write( self, data ):
         """Write data to node.
            data: string"""
-        os.write( self.stdin.fileno(), data )
-
-    def terminate( self ):
-        "Send kill signal to Node and clean up after it."
-        quietRun( 'kill ' + str( self.pid ) )
-        self.cleanup()
+        if self.framed:
+            self.writeFrame( 'D', data )
+        else:
+            os.write( self.stdin.fileno(), data )
+
+    def hangup( self ):
+        """Send kill signal to Node and close our fds, without waiting
+           for it to exit; terminate() reaps it. Does nothing if called
+           again, since our pid may have been reused."""
+        if self.terminated:
+            return
+        if self.pid is None:
+            self.waitStarted()
+        killProcess( self.pid )
+        self.terminated = True
+        self.closeFiles()
+        self.closeSlave()
+
+    def terminate( self, timeoutms=1000 ):
+        """Send kill signal to Node (unless hangup() has) and clean up.
+           timeoutms: how long to wait for our shell to exit before
+               killing it"""
+        self.hangup()
+        self.cleanup( timeoutms )
 
     def stop( self ):
         "Stop node."
@@ -182,9 +453,11 @@ class Node( object ):
 
     def waitReadable( self, timeoutms=None ):
         """Wait until node's output is readable.
-           timeoutms: timeout in ms or None to wait indefinitely."""
+           timeoutms: timeout in ms or None to wait indefinitely.
+           returns: True if output is available"""
         if len( self.readbuf ) == 0:
-            self.pollOut.poll( timeoutms )
+            return self.reactor.waitFd( self.stdout.fileno(), timeoutms )
+        return True
 
     def sendCmd( self, *args, **kwargs ):
         """Send a command, and return without waiting for the command
@@ -192,7 +465,63 @@ class Node( object ):
            args: command and arguments, or string
            printPid: print command's PID?"""
         assert not self.waiting
+        if self.pid is None:
+            self.waitStarted()
         self.serial += 1
+        if not self.inlineMarker and not self.framed:
+            self.flushOutput()
+        if len( args ) > 0:
+            cmd = args
+        if not isinstance( cmd, str ):
+            cmd = ' '.join( cmd )
+        if not re.search( r'\w', cmd ):
+            # Replace empty commands with something harmless
+            cmd = 'echo -n'
+        if self.framed:
+            self.writeFrame( 'C', cmd )
+            if kwargs.get( 'mn_wait', True ):
+                self.lastCmd = cmd
+                self.lastPid = None
+                self.lastStatus = None
+                self.waiting = True
+            return
+        cmd = self.prefixCmd( cmd, **kwargs )
+        if self.inlineMarker:
+            self.marker = chr( 2 ) + str( self.serial ) + chr( 2 )
+            self.stale = ''
+            # The command is passed to eval, so that bash parses it only
+            # after printing the marker; otherwise a syntax error would
+            # make bash reject the whole line, marker and all
+            self.write( "printf '\\002%%d\\002' %d; eval %s\n" %
+                        ( self.serial, quote( cmd ) ) )
+        else:
+            self.write( cmd + '\n' )
+        wait_flag = kwargs.get( 'mn_wait', True)
+        if wait_flag:
+            self.lastCmd = cmd
+            self.lastPid = None
+            self.waiting = True
+
+    @staticmethod
+    def prefixCmd( cmd, printPid=True, mn_use_mnexec=True,
+                   mn_disable_io_buf=False, **_kwargs ):
+        """Prefix a command as sendCmd()'s options ask: with mnexec -p,
+           so that it prints its PID, and optionally with stdbuf, to
+           disable its I/O buffering. Builtins and variable assignments
+           are left alone, since they must run in the shell itself.
+           cmd: command string
+           returns: command string"""
+        if ( printPid and not isShellBuiltin( cmd ) and
+             not re.match( r'\w+=', cmd ) ):
+            if mn_use_mnexec:
+                cmd = 'mnexec -p ' + cmd
+            if mn_disable_io_buf:
+                cmd = 'stdbuf -i0 -o0 -e0 ' + cmd
+        return cmd
+
+    def flushOutput( self ):
+        """Discard stale output by sending a numbered echo sentinel
+           and reading until it and the following prompt appear."""
         self.write( 'echo __   %s   __\n' % self.serial )
         match = '__ %s __' % self.serial
         buf = ''
@@ -206,41 +535,88 @@ class Node( object ):
             if chr( 127 ) in buf:
                 break
             buf += self.read( 1024 )
-        printPid = kwargs.get( 'printPid', True )
-        if len( args ) > 0:
-            cmd = args
-        if not isinstance( cmd, str ):
-            cmd = ' '.join( cmd )
-        if not re.search( r'\w', cmd ):
-            # Replace empty commands with something harmless
-            cmd = 'echo -n'
-        if printPid and not isShellBuiltin( cmd ):
-            use_mnexec = kwargs.get( 'mn_use_mnexec', True)
-            if use_mnexec:
-                cmd = 'mnexec -p ' + cmd
-            disable_io_buf = kwargs.get( 'mn_disable_io_buf', False)
-            if disable_io_buf:
-                cmd = 'stdbuf -i0 -o0 -e0 ' + cmd
-        self.write( cmd + '\n' )
-        wait_flag = kwargs.get( 'mn_wait', True)
-        if wait_flag:
-            self.lastCmd = cmd
-            self.lastPid = None
-            self.waiting = True
+
+    def skipStale( self, data ):
+        """Discard output preceding our command's start marker.
+           data: newly read output
+           returns: output following the marker, if it has arrived"""
+        self.stale += data
+        pos = self.stale.find( self.marker )
+        if pos < 0:
+            # Keep enough to match a marker split across reads
+            self.stale = self.stale[ 1 - len( self.marker ): ]
+            return ''
+        data = self.stale[ pos + len( self.marker ): ]
+        self.marker = None
+        self.stale = ''
+        return data
 
     def sendInt( self, sig=signal.SIGINT ):
         "Interrupt running command."
-        self.write( chr( 3 ) )
+        if self.framed:
+            self.writeFrame( 'I' )
+        else:
+            self.write( chr( 3 ) )
+
+    def interrupt( self, timeoutms=1000, retries=2 ):
+        """Interrupt running command and wait for our prompt to return.
+           If the command ignores the interrupt, the processes our shell
+           is running are killed, and it is interrupted again.
+           timeoutms: how long to wait before interrupting again. A
+               second interrupt is only sent if needed, since a stray
+               one can make the shell discard our next command.
+           retries: how many times to interrupt before giving up, in
+               which case we are left waiting
+           returns: output read while waiting"""
+        output = []
+
+        def drain():
+            "Read output until our prompt returns or we time out."
+            deadline = time() + timeoutms / 1000.0
+            while self.waiting and time() < deadline:
+                output.append( self.monitor( timeoutms=100 ) )
+
+        for _ in range( retries ):
+            if not self.waiting:
+                break
+            self.sendInt()
+            drain()
+            if self.waiting:
+                self.killChildren()
+                drain()
+        if self.waiting:
+            error( '*** %s: could not interrupt %r\n' %
+                   ( self.name, self.lastCmd ) )
+        return ''.join( output )
+
+    def killChildren( self, sig=signal.SIGKILL ):
+        """Send a signal to the processes our shell is running, and to
+           their process groups if they have their own.
+           sig: signal number"""
+        try:
+            shellGroup = os.getpgid( self.pid )
+        except ( OSError, TypeError ):
+            return  # no shell
+        for pid, pgrp in childProcesses( self.pid ):
+            killProcess( pid, sig, group=( pgrp == pid and
+                                           pgrp != shellGroup ) )
 
     def monitor( self, timeoutms=None ):
         """Monitor and return the output of a command.
            Set self.waiting to False if command has completed.
            timeoutms: timeout in ms or None to wait indefinitely."""
-        self.waitReadable( timeoutms )
+        if not self.waitReadable( timeoutms ):
+            return ''
+        if self.framed:
+            if not self.readbuf:
+                self.readFrames()
+            return self.readbuf.read( len( self.readbuf ) )
         data = self.read( 1024 )
+        if self.marker:
+            data = self.skipStale( data )
         # Look for PID
-        marker = chr( 1 ) + r'\d+\r\n'
-        if chr( 1 ) in data:
+        marker = chr( 1 ) + r'\d+\r?\n'
+        if self.lastPid is None and chr( 1 ) in data:
             markers = re.findall( marker, data )
             if markers:
                 self.lastPid = int( markers[ 0 ][ 1: ] )
@@ -254,30 +630,164 @@ class Node( object ):
             data = data.replace( chr( 127 ), '' )
         return data
 
-    def waitOutput( self, verbose=False, pattern=None ):
+    def waitOutput( self, verbose=False, pattern=None, timeoutms=None ):
         """Wait for a command to complete or generate certain output.
            Completion is signaled by a sentinel character, ASCII(127)
            appearing in the output stream.  Wait for the sentinel or
            output matched by a certain pattern, and return the output.
            verbose: print output interactively
-           pattern: compiled regexp or None"""
+           pattern: compiled regexp or None
+           timeoutms: timeout in ms or None to wait indefinitely; if it
+               expires, the command is interrupted and its output is
+               returned as a TimedOut string"""
+        if pattern is not None:
+            index, _match, output = self.expect( pattern, timeoutms,
+                                                 verbose=verbose )
+            if index is None and self.waiting:
+                return TimedOut( output + self.interrupt(), self, timeoutms )
+            return output
+        log = info if verbose else debug
+        deadline = None if timeoutms is None else time() + timeoutms / 1000.0
+        output = []
+        while self.waiting:
+            if deadline is None:
+                data = self.monitor()
+            else:
+                remaining = int( ( deadline - time() ) * 1000 )
+                if remaining <= 0:
+                    output.append( self.interrupt() )
+                    return TimedOut( ''.join( output ), self, timeoutms )
+                data = self.monitor( remaining )
+            output.append( data )
+            log( data )
+        return ''.join( output )
+
+    def expect( self, patterns, timeoutms=None, overlap=256,
+                verbose=False ):
+        """Wait for the running command's output to match any of a set
+           of patterns. Only newly arrived output is scanned, along with
+           the last overlap bytes of earlier output so that matches may
+           span reads.
+           patterns: regexp (compiled or string) or list of regexps
+           timeoutms: timeout in ms or None to wait indefinitely
+           overlap: longest match which may span reads
+           verbose: print output interactively
+           returns: index of matching pattern (None if the command
+               completed or we timed out), match object, output so far"""
         log = info if verbose else debug
-        output = ''
-        while self.waiting and (pattern is None or
-                                not pattern.search(output)):
-            data = self.monitor()
-            output += data
+        if not isinstance( patterns, ( list, tuple ) ):
+            patterns = [ patterns ]
+        patterns = [ re.compile( p ) if isinstance( p, basestring ) else p
+                     for p in patterns ]
+        deadline = None if timeoutms is None else time() + timeoutms / 1000.0
+        output = []
+        tail = ''
+        while self.waiting:
+            if deadline is None:
+                data = self.monitor()
+            else:
+                remaining = int( ( deadline - time() ) * 1000 )
+                if remaining <= 0:
+                    break
+                data = self.monitor( remaining )
+            if not data:
+                continue
+            output.append( data )
             log( data )
-        return output
+            window = tail + data
+            best = None
+            for index, pattern in enumerate( patterns ):
+                match = pattern.search( window )
+                if match and ( best is None or
+                               match.start() < best[ 1 ].start() ):
+                    best = ( index, match )
+            if best:
+                return best[ 0 ], best[ 1 ], ''.join( output )
+            tail = window[ -overlap: ]
+        return None, None, ''.join( output )
+
+    def stream( self, *args, **kwargs ):
+        """Send a command and iterate over its output a line at a time,
+           as the output arrives, until the command completes.
+           Closing the iterator early (e.g. by breaking out of a loop
+           over it) interrupts the command.
+           args: command and arguments, or string
+           returns: iterator over output lines (minus line endings)"""
+        self.sendCmd( *args, **kwargs )
+        lines = ReadBuffer()
+        try:
+            while self.waiting:
+                lines.append( self.monitor() )
+                line = lines.readline()
+                while line is not None:
+                    yield line.rstrip( '\r' )
+                    line = lines.readline()
+            if lines:
+                yield lines.read( len( lines ) )
+        finally:
+            self.interrupt()
+
+    # Coroutine versions of cmd() and waitOutput(), which may be run
+    # concurrently on many nodes by mininet.util.runCoroutines()
+
+    def awaitOutput( self ):
+        """Coroutine: wait for a command to complete.
+           Yields WaitFd( our output fd ) whenever we need to wait for
+           output; the last value yielded is the command's output."""
+        output = []
+        while self.waiting:
+            if not self.readbuf:
+                yield WaitFd( self.stdout.fileno() )
+            output.append( self.monitor( timeoutms=0 ) )
+        yield ''.join( output )
+
+    def acmd( self, *args, **kwargs ):
+        """Coroutine: send a command, wait for it to complete, and
+           yield its output (see awaitOutput().)
+           args: command and arguments, or string"""
+        self.sendCmd( *args, **kwargs )
+        return self.awaitOutput()
 
     def cmd( self, *args, **kwargs ):
         """Send a command, wait for output, and return it.
-           cmd: string"""
+           cmd: string
+           timeoutms: optional timeout in ms (see waitOutput())"""
         verbose = kwargs.get( 'verbose', False )
         log = info if verbose else debug
         log( '*** %s : %s\n' % ( self.name, args ) )
         self.sendCmd( *args, **kwargs )
-        return self.waitOutput( verbose )
+        return self.waitOutput( verbose,
+                                timeoutms=kwargs.get( 'timeoutms' ) )
+
+    # Each command in a batch is followed by ^C + exit status + ^C
+    _batchStatusRegex = re.compile( chr( 3 ) + r'(\d+)' + chr( 3 ) )
+
+    def cmdBatch( self, cmds, verbose=False ):
+        """Send a list of commands in a single write, wait for all
+           of them to complete, and return their outputs.
+           The commands run in sequence in our shell, so they should
+           not read from standard input.
+           cmds: list of command strings
+           verbose: print output interactively
+           returns: list of ( output, exit status ) pairs"""
+        lines = []
+        for cmd in cmds:
+            if not re.search( r'\w', cmd ):
+                cmd = 'true'
+            # As in sendCmd(), eval makes a command which bash can't
+            # parse fail on its own, rather than taking the whole
+            # batch (and its status markers) with it
+            lines.append( "eval %s\nprintf '\\003%%d\\003' $?\n" %
+                          quote( cmd ) )
+        output = self.cmd( '{\n' + ''.join( lines ) + '}', printPid=False,
+                           verbose=verbose )
+        fields = self._batchStatusRegex.split( output )
+        if len( fields ) // 2 != len( cmds ):
+            raise Exception( '%s: expected %d results from batch, got %d:'
+                             ' %r' % ( self.name, len( cmds ),
+                                       len( fields ) // 2, output ) )
+        return [ ( fields[ i ], int( fields[ i + 1 ] ) )
+                 for i in range( 0, len( fields ) - 1, 2 ) ]
 
     def cmdPrint( self, *args):
         """Call cmd and printing its output
@@ -303,38 +813,86 @@ class Node( object ):
         return int(intf[index + len('-eth'):])
             
     def newPort( self ):
-        "Return the next port number to allocate."
-        if len( self.ports ) > 0:
-            return max( self.ports.values() ) + 1
-        return self.portBase
-
-    def addIntf( self, intf, port=None ):
+        """Return the next port number to allocate: the lowest freed
+           port if there is one, or else one past the highest port
+           used so far."""
+        freePorts = self.freePorts
+        while freePorts and freePorts[ 0 ] in self.intfs:
+            heappop( freePorts )
+        if freePorts:
+            return freePorts[ 0 ]
+        return self.nextPort
+
+    def addIntf( self, intf, port=None, move=True ):
         """Add an interface.
            intf: interface name (e.g. nodeN-ethM)
-           port: port number (optional, typically OpenFlow port number)"""
+           port: port number (optional, typically OpenFlow port number)
+           move: move intf into our namespace, if we have one? If
+               False, intf should have been created there already, but
+               is moved anyway if it turns out to be in the root
+               namespace."""
         if port is None:
             port = self.newPort()
-        self.intfs[ port ] = intf
-        self.ports[ intf ] = port
+        self.setPort( intf, port )
+        self.nextPort = max( self.nextPort, port + 1 )
         #info( '\n' )
         #info( 'added intf %s:%d to node %s\n' % ( intf,port, self.name ) )
-        if self.inNamespace:
+        if self.inNamespace and ( move or intfInRoot( intf ) ):
             #info( 'moving w/inNamespace set\n' )
             moveIntf( intf, self )
 
+    def intfNamed( self, intf ):
+        """Return the Intf object for an interface name, creating one
+           (with no port) if necessary.
+           intf: interface name"""
+        obj = self.intfByName.get( intf )
+        if obj is None:
+            obj = self.intfByName[ intf ] = Intf( intf, self )
+            for attrs in self.ips, self.macs:
+                attrs.adopt( obj )
+        return obj
+
+    def setPort( self, intf, port ):
+        """Set (or with None, clear) the port number of an interface.
+           intf: interface name
+           port: port number or None"""
+        obj = self.intfNamed( intf )
+        if obj.port is not None:
+            del self.intfByPort[ obj.port ]
+        if port is not None:
+            old = self.intfByPort.get( port )
+            if old:
+                old.port = None
+            self.intfByPort[ port ] = obj
+        obj.port = port
+
     def registerIntf( self, intf, dstNode, dstIntf ):
         "Register connection of intf to dstIntf on dstNode."
-        self.connection[ intf ] = ( dstNode, dstIntf )
+        self.unregisterIntf( intf )
+        local = self.intfNamed( intf )
+        remote = dstNode.intfNamed( dstIntf )
+        link = remote.link
+        if not link or link.other( remote ) is not local:
+            link = Link( local, remote )
+        local.link = link
+        self.peers.setdefault( dstNode, [] ).append( local )
+
+    def unregisterIntf( self, intf ):
+        "Forget the connection of intf, if any."
+        local = self.intfByName.get( intf )
+        if not local or not local.link:
+            return
+        dstNode = local.peer().node
+        connections = self.peers[ dstNode ]
+        connections.remove( local )
+        if not connections:
+            del self.peers[ dstNode ]
+        local.link = None
 
     def connectionsTo( self, node):
         "Return [(srcIntf, dstIntf)..] for connections to dstNode."
-        # We could optimize this if it is important
-        connections = []
-        for intf in self.connection.keys():
-            dstNode, dstIntf = self.connection[ intf ]
-            if dstNode == node:
-                connections.append( ( intf, dstIntf ) )
-        return connections
+        return [ ( intf.name, intf.peer().name )
+                 for intf in self.peers.get( node, [] ) ]
 
     # This is a symmetric operation, but it makes sense to put
     # the code here since it is tightly coupled to routines in
@@ -354,9 +912,11 @@ class Node( object ):
             port2 = node2.newPort()
         intf1 = node1.intfName( port1 )
         intf2 = node2.intfName( port2 )
-        makeIntfPair( intf1, intf2 )
-        node1.addIntf( intf1, port1 )
-        node2.addIntf( intf2, port2 )
+        placed = makeIntfPair( intf1, intf2,
+                               node1.pid if node1.inNamespace else None,
+                               node2.pid if node2.inNamespace else None )
+        node1.addIntf( intf1, port1, move=not placed )
+        node2.addIntf( intf2, port2, move=not placed )
         node1.registerIntf( intf1, node2, intf2 )
         node2.registerIntf( intf2, node1, intf1 )
         return intf1, intf2
@@ -365,7 +925,7 @@ class Node( object ):
         if node2:
             unlinkList = [node2]
         else:
-            unlinkList = [c[0] for c in self.connection.values()]
+            unlinkList = self.peers.keys()
         
         for node in unlinkList:
             self.deleteIntfsToNode(node)
@@ -373,51 +933,42 @@ class Node( object ):
         
     def deleteIntfsToNode( self, dstNode, dstPort=None ):
         
-        dstIntf = dstNode.intfName(dstPort) if dstPort else None
-        intfs = []
-        for intf in self.connection.keys():
-            nextNode, nextIntf = self.connection[intf]
-            if dstIntf:
-                if nextIntf == dstIntf:
-                    intfs.append(intf)
-            elif nextNode == dstNode:
-                intfs.append(intf)
-
-        #connections = self.connectionsTo(dstNode)
-        #if dstPort:
-        #    dstIntf = dstNode.intfName(dstPort)
-        #    intfs = [connection[0] for connection in connections if connection[1] == dstIntf]
-        #else:
-        #    intfs = [connection[0] for connection in connections]
+        connections = self.connectionsTo(dstNode)
+        if dstPort:
+            dstIntf = dstNode.intfName(dstPort)
+            intfs = [connection[0] for connection in connections if connection[1] == dstIntf]
+        else:
+            intfs = [connection[0] for connection in connections]
         
         for intf in intfs:
             self.deleteIntf(intf)
     
     def deleteIntf(self, intf):
-        del self.connection[intf]
-        port = self.intfToPort(intf)
-        if port is not None:
-            del self.intfs[port]
-        del self.ports[intf]
+        self.unregisterIntf(intf)
+        port = self.ports[intf]
+        self.setPort(intf, None)
+        del self.intfByName[intf]
+        heappush(self.freePorts, port)
+        self.invalidateAddrs( intf )
         
-        quietRun( 'ip link del ' + intf )
-        sleep( 0.001 )
+        deleteLink( intf )
 
     def deletePort(self, port):
         self.deleteIntf(self.intfName(port))
         
     def deleteIntfs( self ):
         "Delete all of our interfaces."
-        # In theory the interfaces should go away after we shut down.
-        # However, this takes time, so we're better off removing them
-        # explicitly so that we won't get errors if we run before they
-        # have been removed by the kernel. Unfortunately this is very slow,
-        # at least with Linux kernels before 2.6.33
-        for intf in self.intfs.values():
-            quietRun( 'ip link del ' + intf )
-            info( '.' )
-            # Does it help to sleep to let things run?
-            sleep( 0.001 )
+        # Interfaces in a network namespace go away with it, once every
+        # process in it has exited. Links in the root namespace may
+        # outlive their peers' namespaces (e.g. if a daemon keeps one
+        # alive), so we delete all of those, which costs little since
+        # deleteLinks() talks netlink and ignores links that are gone.
+        # Only interfaces we created or were given ports on are ours:
+        # others (such as the machine's own eth0) must be left alone.
+        if self.inNamespace:
+            return
+        deleteLinks( [ intf.name for intf in self.intfByName.itervalues()
+                       if intf.port is not None or intf.link ] )
 
     def setMAC( self, intf, mac ):
         """Set the MAC address for an interface.
@@ -425,6 +976,7 @@ class Node( object ):
         result = self.cmd( 'ifconfig', intf, 'down' )
         result += self.cmd( 'ifconfig', intf, 'hw', 'ether', mac )
         result += self.cmd( 'ifconfig', intf, 'up' )
+        self.macs[ intf ] = mac
         return result
 
     def setARP( self, ip, mac ):
@@ -456,6 +1008,70 @@ class Node( object ):
         self.cmd( 'ip route flush root 0/0' )
         return self.cmd( 'route add default ' + intf )
 
+    # ip -batch reports each failed line as "Command failed -:N"
+    _batchFailedRegex = re.compile( r'Command failed -:(\d+)' )
+
+    def configure( self, ips=None, macs=None, up=None, down=None,
+                   defaultRoute=None, hostRoutes=None, priority=None ):
+        """Apply interface, route and priority settings in a single
+           round trip, feeding ip(8) a batch of commands. Errors in
+           individual settings are reported in the output but don't
+           stop the rest from being applied.
+           ips: dict of interface names to ( IP address, prefix length )
+           macs: dict of interface names to MAC addresses
+           up: list of interfaces to bring up (interfaces given an
+               address or MAC are brought up anyway)
+           down: list of interfaces to bring down
+           defaultRoute: interface to route everything through
+           hostRoutes: dict of host IP addresses to interfaces
+           priority: niceness for our shell and its commands
+           returns: output"""
+        ips, macs = ips or {}, macs or {}
+        lines = []
+        macLines, ipLines = {}, {}  # batch line numbers setting addresses
+        for intf, mac in macs.items():
+            lines += [ 'link set dev %s down' % intf,
+                       'link set dev %s address %s' % ( intf, mac ) ]
+            macLines[ intf ] = len( lines )
+        for intf, ( ip, prefixLen ) in ips.items():
+            lines += [ 'addr flush dev %s scope global' % intf,
+                       'addr add %s/%d brd + dev %s' % ( ip, prefixLen, intf ) ]
+            ipLines[ intf ] = len( lines )
+        for intf in set( macs.keys() + ips.keys() + list( up or [] ) ):
+            lines.append( 'link set dev %s up' % intf )
+        for intf in down or []:
+            lines.append( 'link set dev %s down' % intf )
+        if defaultRoute:
+            lines += [ 'route flush root 0/0',
+                       'route add default dev %s' % defaultRoute ]
+        for ip, intf in ( hostRoutes or {} ).items():
+            lines.append( 'route replace %s/32 dev %s' % ( ip, intf ) )
+        cmds = []
+        if lines:
+            cmds.append( "printf '%%s\\n' %s | ip -force -batch -" %
+                         ' '.join( "'%s'" % line for line in lines ) )
+        if priority is not None:
+            cmds.append( 'renice %+d -p %d > /dev/null' %
+                         ( priority, self.pid ) )
+        if not cmds:
+            return ''
+        result = self.cmd( '; '.join( cmds ), printPid=False )
+        # Only cache addresses which were applied; the rest are
+        # re-read by IP() and MAC()
+        failed = set( int( line ) for line in
+                      self._batchFailedRegex.findall( result ) )
+        for intf, ( ip, _prefixLen ) in ips.items():
+            if ipLines[ intf ] in failed:
+                self.ips.pop( intf, None )
+            else:
+                self.ips[ intf ] = ip
+        for intf, mac in macs.items():
+            if macLines[ intf ] in failed:
+                self.macs.pop( intf, None )
+            else:
+                self.macs[ intf ] = mac
+        return result
+
     def defaultIntf( self ):
         "Return interface for lowest port"
         ports = self.intfs.keys()
@@ -469,7 +1085,8 @@ class Node( object ):
         "Return IP address of a node or specific interface."
         if intf is None:
             intf = self.defaultIntf()
-        if intf and not self.waiting:
+        if intf and not self.waiting and (
+            self.rereadAddrs or intf not in self.ips ):
             self.updateIP( intf )
         return self.ips.get( intf, None )
 
@@ -477,7 +1094,8 @@ class Node( object ):
         "Return MAC address of a node or specific interface."
         if intf is None:
             intf = self.defaultIntf()
-        if intf and not self.waiting:
+        if intf and not self.waiting and (
+            self.rereadAddrs or intf not in self.macs ):
             self.updateMAC( intf )
         return self.macs.get( intf, None )
 
@@ -489,7 +1107,8 @@ class Node( object ):
         if ips:
             self.ips[ intf ] = ips[ 0 ]
         else:
-            self.ips[ intf ] = None
+            # Not cached, so that an address assigned later is seen
+            self.ips.pop( intf, None )
 
     def updateMAC( self, intf ):
         "Update MAC address for an interface"
@@ -499,7 +1118,17 @@ class Node( object ):
         if macs:
             self.macs[ intf ] = macs[ 0 ]
         else:
-            self.macs[ intf ] = None
+            self.macs.pop( intf, None )
+
+    def invalidateAddrs( self, intf=None ):
+        """Forget cached addresses, so that IP() and MAC() re-read them.
+           intf: interface name, or None for all interfaces"""
+        if intf is None:
+            self.ips.clear()
+            self.macs.clear()
+        else:
+            self.ips.pop( intf, None )
+            self.macs.pop( intf, None )
 
     def intfIsUp( self, intf ):
         "Check if an interface is up."
@@ -512,10 +1141,189 @@ class Node( object ):
             self.name, self.IP(), ','.join( intfs ), self.pid )
 
 
+class TimedOut( str ):
+    """Output of a command which was interrupted because it did not
+       complete in time. Otherwise behaves as a string.
+       node: node the command ran on
+       cmd: the command
+       timeoutms: the timeout which expired"""
+
+    def __new__( cls, output, node, timeoutms ):
+        result = str.__new__( cls, output )
+        result.node = node
+        result.cmd = node.lastCmd
+        result.timeoutms = timeoutms
+        return result
+
+    def __repr__( self ):
+        return '<TimedOut %s: %r after %d ms>' % (
+            self.node.name, self.cmd, self.timeoutms )
+
+
 class Host( Node ):
     "A host is simply a Node."
 
 
+class LightHost( Host ):
+    """A host without a shell, for very large topologies: its network
+       namespace is held open by a sleeping process, and each command
+       runs in a fresh shell started in the namespace. So it has no
+       fds open between commands, but shell state (working directory,
+       variables, jobs) doesn't persist, and commands left running in
+       the background should redirect their output, since the pipe
+       it was going to is closed once the command completes.
+       Commands sent with mn_wait=False run on their own, with their
+       output discarded. Between commands, stdout is None."""
+
+    def __init__( self, name, **kwargs ):
+        self.pin = None  # process holding our namespace open
+        self.proc = None  # running command, if any
+        self.eof = False  # has the running command closed its output?
+        self.detached = []  # commands sent with mn_wait=False
+        self.priority = None  # niceness for our commands
+        Host.__init__( self, name, **kwargs )
+
+    def startShell( self ):
+        "Start the process which holds our namespace open."
+        opts = '-cd'
+        if self.inNamespace:
+            opts += 'n'
+        opts += 'p'
+        self.pin = self.shell = Popen(
+            rootCmd( [ 'mnexec', opts, 'sleep', 'infinity' ] ), stdout=PIPE )
+        self.openOutput( stdout=self.pin.stdout )
+
+    def openOutput( self, stdin=None, stdout=None ):
+        "Use the given files to talk to our current process."
+        self.stdin, self.stdout = stdin, stdout
+        self.outToNode[ stdout.fileno() ] = self
+        if stdin:
+            self.inToNode[ stdin.fileno() ] = self
+
+    def checkStarted( self ):
+        """Read the namespace process's PID banner, then close our pipe
+           from it.
+           returns: True if it has started"""
+        if Host.checkStarted( self ) and self.stdout is self.pin.stdout:
+            self.closeFiles()
+        return self.pid is not None
+
+    def sendCmd( self, *args, **kwargs ):
+        """Start a command in our namespace, and return without waiting
+           for it to complete.
+           args: command and arguments, or string
+           printPid: print command's PID?"""
+        assert not self.waiting
+        if self.pid is None:
+            self.waitStarted()
+        cmd = args[ 0 ] if len( args ) == 1 else args
+        if not isinstance( cmd, str ):
+            cmd = ' '.join( cmd )
+        cmd = self.prefixCmd( cmd, **kwargs )
+        self.detached = [ proc for proc in self.detached
+                          if proc.poll() is None ]
+        if not kwargs.get( 'mn_wait', True ):
+            # Nobody will wait for this one, so nobody reads its output
+            with open( os.devnull, 'w' ) as devnull:
+                self.detached.append( Popen(
+                    self.shellCmd( cmd ),
+                    stdout=devnull, stderr=STDOUT, preexec_fn=os.setpgrp ) )
+            return
+        # As in a node shell, ^? marks completion
+        self.proc = Popen( self.shellCmd( cmd + "\nprintf '\\177'" ),
+                           stdin=PIPE, stdout=PIPE, stderr=STDOUT,
+                           preexec_fn=os.setpgrp )
+        self.openOutput( self.proc.stdin, self.proc.stdout )
+        self.eof = False
+        self.lastCmd = cmd
+        self.lastPid = None
+        self.waiting = True
+
+    def shellCmd( self, cmd ):
+        """Return a command line which runs cmd in a fresh shell in our
+           namespace, at the priority given to configure(), if any.
+           cmd: string"""
+        args = [ 'mnexec', '-ca', str( self.pid ) ]
+        if self.priority is not None:
+            args += [ 'nice', '-n', str( self.priority ) ]
+        return rootCmd( args + [ 'bash', '-c', cmd ] )
+
+    def configure( self, ips=None, macs=None, up=None, down=None,
+                   defaultRoute=None, hostRoutes=None, priority=None ):
+        """As Node.configure(), except that since we have no shell to
+           renice, priority applies to each command we run from now on."""
+        if priority is not None:
+            self.priority = priority
+        return Host.configure( self, ips=ips, macs=macs, up=up, down=down,
+                               defaultRoute=defaultRoute,
+                               hostRoutes=hostRoutes )
+
+    def sendInt( self, sig=signal.SIGINT ):
+        "Interrupt running command."
+        if self.proc:
+            killProcess( self.proc.pid, sig, group=True )
+
+    def killChildren( self, sig=signal.SIGKILL ):
+        """Send a signal to the running command's process group, which
+           holds its processes (unless they made groups of their own.)
+           sig: signal number"""
+        self.sendInt( sig )
+
+    def read( self, bytes=1024 ):
+        """Buffered read from running command, non-blocking.
+           bytes: maximum number of bytes to return"""
+        data = Host.read( self, bytes )
+        if not data:
+            self.eof = True
+        return data
+
+    def readline( self ):
+        """Buffered readline from running command, non-blocking.
+           returns: line (minus newline) or None"""
+        line = self.readbuf.readline()
+        if line is None and self.stdout:
+            data = os.read( self.stdout.fileno(), 1024 )
+            if not data:
+                # The command has completed (or been killed)
+                self.finishCmd()
+            self.readbuf.append( data )
+            line = self.readbuf.readline()
+        return line
+
+    def monitor( self, timeoutms=None ):
+        """Monitor and return the output of a command.
+           Set self.waiting to False if command has completed.
+           timeoutms: timeout in ms or None to wait indefinitely."""
+        if not self.proc:
+            return ''
+        data = Host.monitor( self, timeoutms )
+        if self.eof:
+            # The command was killed before it could print ^?
+            self.waiting = False
+        if not self.waiting:
+            self.finishCmd()
+        return data
+
+    def finishCmd( self ):
+        "Close our pipes to the last command and reap it."
+        self.closeFiles()
+        self.proc.wait()
+        self.proc = None
+        self.waiting = False
+
+    def hangup( self ):
+        "Kill any running commands and our namespace process."
+        if self.proc:
+            self.sendInt( signal.SIGKILL )
+            self.finishCmd()
+        for proc in self.detached:
+            if proc.poll() is None:
+                killProcess( proc.pid, signal.SIGKILL, group=True )
+                proc.wait()
+        self.detached = []
+        Host.hangup( self )
+
+
 class Switch( Node ):
     """A Switch is a Node that is running (or has execed?)
        an OpenFlow switch."""
@@ -544,9 +1352,7 @@ class Switch( Node ):
 
     def startIntfs( self ):
         "Default function to start interfaces"
-        self.cmd("ifconfig lo up")
-        for intf in self.intfs.values():
-            self.cmd("ifconfig " + intf + " up" )
+        self.configure( up=[ 'lo' ] + self.intfs.values() )
 
     def sendCmd( self, *cmd, **kwargs ):
         """Send command to Node.
@@ -567,8 +1373,6 @@ class UserSwitch( Switch ):
         Switch.__init__( self, name, **kwargs )
         pathCheck( 'ofdatapath', 'ofprotocol',
             moduleName='the OpenFlow reference user switch (openflow.org)' )
-        self.cmd( 'kill %ofdatapath' )
-        self.cmd( 'kill %ofprotocol' )
 
     @staticmethod
     def setup():
@@ -582,6 +1386,9 @@ class UserSwitch( Switch ):
            controllers: list of controller objects"""
         ofdlog = '/tmp/' + self.name + '-ofd.log'
         ofplog = '/tmp/' + self.name + '-ofp.log'
+        # Kill any datapath left from an earlier start()
+        self.cmd( 'kill %ofdatapath' )
+        self.cmd( 'kill %ofprotocol' )
         self.startIntfs()
         mac_str = ''
         if self.defaultMAC:
@@ -758,8 +1565,8 @@ class OVSKernelSwitchNew( Switch ):
         quietRun( self.vsctl_cmd + ' -- --if-exists del-br ' + self.dp )
         self.deleteIntfs()
 
-    def addIntf( self, intf, port ):
-        super(OVSKernelSwitchNew, self).addIntf(intf, port)
+    def addIntf( self, intf, port, move=True ):
+        super(OVSKernelSwitchNew, self).addIntf(intf, port, move)
         self.cmd( self.vsctl_cmd + ' -- --may-exist', 'add-port', self.dp, intf )
     
     def deleteIntf( self, intf ):
@@ -828,8 +1635,8 @@ class OVSKernelSwitch( Switch ):
         self.cmd( 'kill %ovs-openflowd' )
         self.deleteIntfs()
 
-    def addIntf( self, intf, port ):
-        super(OVSKernelSwitch, self).addIntf(intf, port)
+    def addIntf( self, intf, port, move=True ):
+        super(OVSKernelSwitch, self).addIntf(intf, port, move)
         self.cmd( 'ovs-dpctl', 'add-if', self.dp, intf )
     
     def deleteIntf( self, intf ):
@@ -950,6 +1757,23 @@ class Controller( Node ):
             ip = self.defaultIP
         return ip
 
+class ControllerAddr( object ):
+    """A controller's IP address and port, read once, for switches to
+       connect to. Switches started in parallel are given these rather
+       than the controllers, so that they don't run commands on the
+       same controller node from several threads."""
+
+    def __init__( self, controller ):
+        """Init.
+           controller: Controller to take the address of"""
+        self.name = controller.name
+        self.ip = controller.IP()
+        self.port = controller.port
+
+    def IP( self ):
+        "Return IP address of the Controller"
+        return self.ip
+
 class ControllerParams( object ):
     "Container for controller IP parameters."
 
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+
+"""Package: mininet
+   Benchmark reading large command output from a node.
+   Time per MB should stay flat as the output size grows."""
+
+from time import time
+
+from mininet.net import init
+from mininet.node import Node
+from mininet.log import setLogLevel, output
+
+SIZES = [ 12.5, 25, 50, 100 ]  # MB of output
+
+def benchOutput( node, mbytes ):
+    "Time cmd() on a command printing mbytes MB; return seconds."
+    count = int( mbytes * 1024 * 1024 )
+    start = time()
+    result = node.cmd( 'head -c %d /dev/zero | tr "\\\\000" x' % count )
+    elapsed = time() - start
+    # No newlines, so the pty adds no carriage returns
+    assert result.count( 'x' ) == count
+    return elapsed
+
+def benchNodeIO():
+    "Run the benchmark on a single node."
+    init()
+    node = Node( 'h1' )
+    output( '*** Reading command output through Node.cmd()\n' )
+    for mbytes in SIZES:
+        elapsed = benchOutput( node, mbytes )
+        output( '%6.1f MB: %6.2f s, %6.3f s/MB\n' %
+                ( mbytes, elapsed, elapsed / mbytes ) )
+    node.terminate()
+
+if __name__ == '__main__':
+    setLogLevel( 'output' )
+    benchNodeIO()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+"""Package: mininet
+   Soak test: build and stop a network many times in one process.
+   Resident memory and open fds should stay flat across cycles."""
+
+import os
+import sys
+
+from mininet.net import Mininet
+from mininet.topo import SingleSwitchTopo
+from mininet.log import setLogLevel, output
+
+CYCLES = 500
+REPORT = 50  # report usage every REPORT cycles
+
+def usage():
+    "Return our resident set size in kB and number of open fds."
+    rss = 0
+    for line in open( '/proc/self/status' ):
+        if line.startswith( 'VmRSS:' ):
+            rss = int( line.split()[ 1 ] )
+    return rss, len( os.listdir( '/proc/self/fd' ) )
+
+def buildNet():
+    "Build and start a small network."
+    net = Mininet( topo=SingleSwitchTopo( k=2 ) )
+    net.start()
+    return net
+
+def soak( cycles=CYCLES, build=buildNet ):
+    """Build and stop a network repeatedly, reporting resource usage.
+       cycles: number of build/stop cycles
+       build: function which returns a started Mininet
+       returns: list of ( cycle, rss in kB, open fds )"""
+    results = []
+    for cycle in range( 1, cycles + 1 ):
+        net = build()
+        net.stop()
+        if cycle == 1 or cycle % REPORT == 0:
+            rss, fds = usage()
+            results.append( ( cycle, rss, fds ) )
+            output( 'cycle %4d: rss %7d kB, %4d fds\n' % ( cycle, rss, fds ) )
+    return results
+
+if __name__ == '__main__':
+    setLogLevel( 'output' )
+    soak( int( sys.argv[ 1 ] ) if len( sys.argv ) > 1 else CYCLES )
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+"""Package: mininet
+   Test the interface and link objects, and the dict-style views of them
+   presented by nodes. Uses nodes without shells, so needs no root."""
+
+import unittest
+
+from mininet.node import Node
+from mininet.link import Intf, Link
+
+
+class ShelllessNode( Node ):
+    "Node which doesn't start a shell, for testing its bookkeeping."
+
+    def startShell( self ):
+        self.stdin = self.stdout = None
+
+
+def makeNode( name ):
+    "Return a shell-less node in the root namespace."
+    return ShelllessNode( name, inNamespace=False, waitStart=False )
+
+
+class testIntf( unittest.TestCase ):
+    "Test Intf and Link objects."
+
+    def testUnsetAddresses( self ):
+        "Addresses are unset until known"
+        intf = Intf( 'n1-eth0', None, 0 )
+        self.assertFalse( hasattr( intf, 'ip' ) )
+        self.assertFalse( hasattr( intf, 'mac' ) )
+        intf.ip = '10.0.0.1'
+        self.assertEqual( intf.ip, '10.0.0.1' )
+
+    def testSlots( self ):
+        "Intf and Link have no per-instance dict"
+        intf = Intf( 'n1-eth0', None )
+        self.assertRaises( AttributeError, setattr, intf, 'bogus', 1 )
+        link = Link( intf, intf )
+        self.assertRaises( AttributeError, setattr, link, 'bogus', 1 )
+
+    def testPeer( self ):
+        "Each end of a link sees the other"
+        intf1, intf2 = Intf( 'n1-eth0', None ), Intf( 'n2-eth0', None )
+        self.assertEqual( intf1.peer(), None )
+        intf1.link = intf2.link = Link( intf1, intf2 )
+        self.assertTrue( intf1.peer() is intf2 )
+        self.assertTrue( intf2.peer() is intf1 )
+
+
+class testNodeIntfs( unittest.TestCase ):
+    "Test a node's interface indexes and its dict-style views of them."
+
+    def setUp( self ):
+        self.n1 = makeNode( 'n1' )
+        self.n2 = makeNode( 'n2' )
+
+    def testAddIntf( self ):
+        "Ports are allocated in order, and views agree with the indexes"
+        self.n1.addIntf( 'n1-eth0', move=False )
+        self.n1.addIntf( 'n1-eth1', move=False )
+        self.assertEqual( dict( self.n1.intfs ), { 0: 'n1-eth0',
+                                                   1: 'n1-eth1' } )
+        self.assertEqual( dict( self.n1.ports ), { 'n1-eth0': 0,
+                                                   'n1-eth1': 1 } )
+        self.assertEqual( self.n1.intfByPort[ 1 ].name, 'n1-eth1' )
+        self.assertEqual( self.n1.newPort(), 2 )
+
+    def testExplicitPort( self ):
+        "Explicit ports move nextPort past them"
+        self.n1.addIntf( 'n1-eth5', 5, move=False )
+        self.assertEqual( self.n1.newPort(), 6 )
+
+    def testSetPort( self ):
+        "Assigning through intfs or ports re-indexes the interface"
+        self.n1.intfs[ 3 ] = 'n1-eth3'
+        self.assertEqual( self.n1.ports[ 'n1-eth3' ], 3 )
+        self.n1.ports[ 'n1-eth3' ] = 4
+        self.assertFalse( 3 in self.n1.intfs )
+        self.assertEqual( self.n1.intfs[ 4 ], 'n1-eth3' )
+        del self.n1.ports[ 'n1-eth3' ]
+        self.assertEqual( self.n1.intfs.keys(), [] )
+        self.assertRaises( KeyError, lambda: self.n1.ports[ 'n1-eth3' ] )
+
+    def testAddrViews( self ):
+        "ips and macs only list interfaces whose addresses are known"
+        self.n1.addIntf( 'n1-eth0', move=False )
+        self.assertEqual( self.n1.ips.keys(), [] )
+        self.assertRaises( KeyError, lambda: self.n1.ips[ 'n1-eth0' ] )
+        self.n1.ips[ 'n1-eth0' ] = '10.0.0.1'
+        self.n1.macs[ 'n1-eth0' ] = '00:00:00:00:00:01'
+        self.assertEqual( self.n1.intfByName[ 'n1-eth0' ].ip, '10.0.0.1' )
+        self.assertEqual( dict( self.n1.macs ),
+                          { 'n1-eth0': '00:00:00:00:00:01' } )
+        del self.n1.ips[ 'n1-eth0' ]
+        self.assertFalse( 'n1-eth0' in self.n1.ips )
+        self.assertRaises( KeyError, self.n1.ips.__delitem__, 'n1-eth0' )
+
+    def testUnownedAddrs( self ):
+        "Addresses of interfaces the node didn't create make no Intf"
+        self.n1.ips[ 'eth0' ] = '192.168.0.1'
+        self.n1.macs[ 'eth0' ] = '00:00:00:00:00:01'
+        self.assertEqual( self.n1.intfByName, {} )
+        self.assertEqual( self.n1.ips[ 'eth0' ], '192.168.0.1' )
+        self.assertEqual( self.n1.ips.keys(), [ 'eth0' ] )
+        del self.n1.macs[ 'eth0' ]
+        self.assertFalse( 'eth0' in self.n1.macs )
+        # If the node later takes the interface on, the Intf gets it
+        self.n1.addIntf( 'eth0', move=False )
+        self.assertEqual( self.n1.intfByName[ 'eth0' ].ip, '192.168.0.1' )
+        self.assertEqual( self.n1.ips.other, {} )
+        self.assertEqual( self.n1.ips.keys(), [ 'eth0' ] )
+
+    def testConnections( self ):
+        "Registered links are shared and indexed by peer"
+        self.n1.addIntf( 'n1-eth0', move=False )
+        self.n2.addIntf( 'n2-eth0', move=False )
+        self.n1.registerIntf( 'n1-eth0', self.n2, 'n2-eth0' )
+        self.n2.registerIntf( 'n2-eth0', self.n1, 'n1-eth0' )
+        self.assertEqual( self.n1.connection[ 'n1-eth0' ],
+                          ( self.n2, 'n2-eth0' ) )
+        self.assertEqual( self.n1.connectionsTo( self.n2 ),
+                          [ ( 'n1-eth0', 'n2-eth0' ) ] )
+        link = self.n1.intfByName[ 'n1-eth0' ].link
+        self.assertTrue( link is self.n2.intfByName[ 'n2-eth0' ].link )
+        self.assertEqual( self.n1.peers.keys(), [ self.n2 ] )
+        del self.n1.connection[ 'n1-eth0' ]
+        self.assertEqual( self.n1.connection.keys(), [] )
+        self.assertEqual( self.n1.peers, {} )
+        self.assertEqual( self.n1.connectionsTo( self.n2 ), [] )
+
+    def testClear( self ):
+        "Clearing a view clears only that attribute"
+        self.n1.addIntf( 'n1-eth0', move=False )
+        self.n1.ips[ 'n1-eth0' ] = '10.0.0.1'
+        self.n1.ips.clear()
+        self.assertEqual( len( self.n1.ips ), 0 )
+        self.assertEqual( self.n1.intfs[ 0 ], 'n1-eth0' )
+
+
+if __name__ == '__main__':
+    unittest.main()
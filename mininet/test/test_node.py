@@ -0,0 +1,507 @@
+#!/usr/bin/env python
+
+"""Package: mininet
+   Test running commands on individual nodes (requires root and mnexec,
+   but no switches.)"""
+
+import os
+import unittest
+from time import time
+
+from mininet.node import Node, Host, LightHost, TimedOut, Spawner
+from mininet.node import Controller, ControllerAddr
+from mininet.log import setLogLevel
+from mininet.util import runCoroutines, intfInRoot, quietRun, RootHelper
+
+
+class testCmd( unittest.TestCase ):
+    "Test Node.cmd() and friends on a single host."
+
+    def setUp( self ):
+        self.host = Host( 'h1' )
+
+    def tearDown( self ):
+        self.host.terminate()
+
+    def testEcho( self ):
+        "Simple command output"
+        self.assertEqual( self.host.cmd( 'echo hello' ).split()[ 0 ],
+                          'hello' )
+
+    def testSyntaxError( self ):
+        "A command bash can't parse returns its error rather than hanging"
+        output = self.host.cmd( 'echo )', timeoutms=5000 )
+        self.assertTrue( 'syntax error' in output )
+        # The shell should still be usable afterwards
+        self.assertTrue( 'ok' in self.host.cmd( 'echo ok' ) )
+
+    def testKeywords( self ):
+        "Shell keywords and assignments run in the node's shell"
+        output = self.host.cmd( 'for i in 1 2; do echo x$i; done' )
+        self.assertEqual( output.split()[ :2 ], [ 'x1', 'x2' ] )
+        self.host.cmd( 'v=42' )
+        self.assertTrue( '42' in self.host.cmd( 'echo $v' ) )
+
+    def testTimeoutIgnoringInterrupt( self ):
+        "A timed-out command which ignores ^C is killed, even without a PID"
+        start = time()
+        output = self.host.cmd( 'trap "" INT; sleep 30', printPid=False,
+                                timeoutms=500 )
+        self.assertTrue( time() - start < 10 )
+        self.assertEqual( output.timeoutms, 500 )
+        self.host.cmd( 'trap - INT' )
+        self.assertTrue( 'ok' in self.host.cmd( 'echo ok' ) )
+
+    def testTimeout( self ):
+        "A command which takes too long is interrupted"
+        start = time()
+        output = self.host.cmd( 'sleep 30', timeoutms=300 )
+        self.assertTrue( isinstance( output, TimedOut ) )
+        self.assertTrue( time() - start < 10 )
+        self.assertTrue( 'ok' in self.host.cmd( 'echo ok' ) )
+
+    def testLargeOutput( self ):
+        "Large outputs arrive complete and in order"
+        output = self.host.cmd( 'seq 100000' )
+        self.assertEqual( [ line for line in output.split()
+                            if line.isdigit() ],
+                          [ str( i ) for i in range( 1, 100001 ) ] )
+
+    def testCmdBatch( self ):
+        "Batched commands return their own outputs and exit statuses"
+        results = self.host.cmdBatch( [ 'echo one', 'false', 'echo two' ] )
+        self.assertEqual( [ status for _output, status in results ],
+                          [ 0, 1, 0 ] )
+        self.assertTrue( 'one' in results[ 0 ][ 0 ] )
+        self.assertTrue( 'two' in results[ 2 ][ 0 ] )
+        self.assertFalse( 'one' in results[ 2 ][ 0 ] )
+
+    def testCmdBatchSyntaxError( self ):
+        "A command bash can't parse fails alone, not the whole batch"
+        results = self.host.cmdBatch( [ 'echo a', 'echo )', 'cat <<EOF',
+                                        'echo b' ] )
+        self.assertEqual( len( results ), 4 )
+        self.assertTrue( 'syntax error' in results[ 1 ][ 0 ] )
+        self.assertNotEqual( results[ 1 ][ 1 ], 0 )
+        self.assertTrue( 'b' in results[ 3 ][ 0 ] )
+        self.assertEqual( results[ 3 ][ 1 ], 0 )
+
+    def testStream( self ):
+        "stream() yields lines as they arrive"
+        lines = self.host.stream( 'for i in 1 2 3; do echo $i; done' )
+        self.assertEqual( [ line for line in lines if line.isdigit() ],
+                          [ '1', '2', '3' ] )
+
+    def testStreamClose( self ):
+        "Abandoning a stream interrupts its command"
+        for line in self.host.stream( 'while true; do echo x; sleep .1; '
+                                      'done' ):
+            if 'x' in line:
+                break
+        self.assertFalse( self.host.waiting )
+        self.assertTrue( 'ok' in self.host.cmd( 'echo ok' ) )
+
+    def testAcmd( self ):
+        "Coroutine commands on several hosts run concurrently"
+        other = Host( 'h2' )
+        try:
+            results = runCoroutines( [ self.host.acmd( 'sleep .2; echo one' ),
+                                       other.acmd( 'sleep .2; echo two' ) ] )
+        finally:
+            other.terminate()
+        self.assertTrue( 'one' in results[ 0 ] )
+        self.assertTrue( 'two' in results[ 1 ] )
+
+    def testExpect( self ):
+        "expect() returns the first pattern which matches, or times out"
+        self.host.sendCmd( 'echo ready; sleep 30' )
+        index, match, output = self.host.expect( [ 'never', 'rea(dy)' ],
+                                                 timeoutms=5000 )
+        self.assertEqual( index, 1 )
+        self.assertEqual( match.group( 1 ), 'dy' )
+        self.assertTrue( 'ready' in output )
+        index, match, _output = self.host.expect( 'never', timeoutms=300 )
+        self.assertEqual( ( index, match ), ( None, None ) )
+        self.host.interrupt()
+        self.assertFalse( self.host.waiting )
+
+    def testPopen( self ):
+        "popen() processes run concurrently in the node's namespace"
+        procs = [ self.host.popen( 'sh -c "sleep .2; ip link"' )
+                  for _ in range( 3 ) ]
+        for proc in procs:
+            out, _err = proc.communicate()
+            self.assertTrue( 'lo:' in out )
+            self.assertFalse( 'eth0' in out )
+
+    def testPexec( self ):
+        "pexec() splits command strings as the shell would"
+        out, _err, status = self.host.pexec( 'sh -c \'echo "a  b"; exit 3\'' )
+        self.assertEqual( ( out, status ), ( 'a  b\n', 3 ) )
+
+
+class testLightHost( unittest.TestCase ):
+    "Test LightHost, which runs each command in a fresh shell."
+
+    def setUp( self ):
+        self.host = LightHost( 'h1' )
+
+    def tearDown( self ):
+        self.host.terminate()
+
+    def testCmd( self ):
+        "Commands run in the host's namespace, with no fds left open"
+        self.assertEqual( self.host.stdout, None )
+        output = self.host.cmd( 'echo hello; ip link' )
+        self.assertTrue( 'hello' in output )
+        self.assertTrue( 'lo:' in output )
+        self.assertFalse( 'eth0' in output )
+        self.assertEqual( self.host.stdout, None )
+        self.assertEqual( Node.pollNodes( [ self.host ], 0 ), [] )
+
+    def testKeywords( self ):
+        "Shell keywords and assignments run in the command's shell"
+        self.assertEqual( self.host.cmd( 'v=3' ), '' )
+        output = self.host.cmd( 'for i in 1 2; do echo x$i; done' )
+        self.assertEqual( output.split(), [ 'x1', 'x2' ] )
+
+    def testNoWait( self ):
+        "Commands sent with mn_wait=False run on their own"
+        self.host.sendCmd( 'sleep 30', mn_wait=False )
+        self.assertFalse( self.host.waiting )
+        self.assertTrue( 'ok' in self.host.cmd( 'echo ok' ) )
+        self.assertTrue( 'sleep 30' in self.host.cmd( 'ps -eo args' ) )
+
+    def testTimeoutIgnoringInterrupt( self ):
+        "A timed-out command which ignores ^C is killed"
+        start = time()
+        output = self.host.cmd( 'trap "" INT; sleep 30', printPid=False,
+                                timeoutms=500 )
+        self.assertTrue( isinstance( output, TimedOut ) )
+        self.assertTrue( time() - start < 10 )
+        self.assertFalse( self.host.waiting )
+        self.assertEqual( self.pinAlive(), True )
+        self.assertTrue( 'ok' in self.host.cmd( 'echo ok' ) )
+
+    def testPriority( self ):
+        "Commands run at the priority given to configure()"
+        self.host.configure( priority=5 )
+        self.assertEqual( self.host.cmd( 'nice' ).split()[ 0 ], '5' )
+        self.host.sendCmd( 'sleep 30', mn_wait=False )
+        output = self.host.cmd( 'ps -o ni= -C sleep' )
+        self.assertTrue( '5' in output.split() )
+
+    def pinAlive( self ):
+        "Is the process holding the host's namespace still running?"
+        return self.host.pin.poll() is None
+
+
+class testTerminate( unittest.TestCase ):
+    "Test stopping hosts, as Mininet.stop() does."
+
+    def testHangupFirst( self ):
+        "Hosts signalled together are reaped within a shared timeout"
+        hosts = [ Host( 'h%d' % i ) for i in range( 1, 5 ) ]
+        for host in hosts:
+            # Ignore SIGTERM and SIGHUP, and don't read from the pty
+            host.sendCmd( 'trap "" TERM HUP; echo ready; '
+                          'while :; do sleep 1; done' )
+            host.expect( 'ready', timeoutms=5000 )
+        start = time()
+        for host in hosts:
+            host.hangup()
+        for host in hosts:
+            host.terminate( max( 0, int( ( start + 1 - time() ) * 1000 ) ) )
+        self.assertTrue( time() - start < 2 )
+        for host in hosts:
+            self.assertEqual( host.shell, None )
+            self.assertEqual( host.stdout, None )
+
+
+class testControllerAddr( unittest.TestCase ):
+    "Test ControllerAddr, which switches started in parallel are given."
+
+    def testAddr( self ):
+        "The address is read once, and needs no controller afterwards"
+        controller = Controller( 'c0', port=6634 )
+        addr = ControllerAddr( controller )
+        controller.terminate()
+        self.assertEqual( ( addr.name, addr.IP(), addr.port ),
+                          ( 'c0', '127.0.0.1', 6634 ) )
+
+
+class testAddrs( unittest.TestCase ):
+    "Test the interface address cache behind IP() and MAC()."
+
+    def setUp( self ):
+        self.host = Host( 'h1' )
+        self.host.cmd( 'ip link add d0 type veth peer name d1' )
+
+    def tearDown( self ):
+        self.host.terminate()
+
+    def testCached( self ):
+        "Addresses are read once, until invalidated"
+        self.host.setIP( 'd0', '10.0.0.1' )
+        self.assertEqual( self.host.IP( 'd0' ), '10.0.0.1' )
+        self.host.cmd( 'ifconfig d0 10.0.0.2' )
+        self.assertEqual( self.host.IP( 'd0' ), '10.0.0.1' )
+        self.host.invalidateAddrs( 'd0' )
+        self.assertEqual( self.host.IP( 'd0' ), '10.0.0.2' )
+        mac = self.host.MAC( 'd0' )
+        self.assertEqual( len( mac.split( ':' ) ), 6 )
+        self.host.setMAC( 'd0', '00:00:00:00:00:0a' )
+        self.assertEqual( self.host.MAC( 'd0' ), '00:00:00:00:00:0a' )
+
+    def testUnsetNotCached( self ):
+        "An interface without an address is checked again next time"
+        self.assertEqual( self.host.IP( 'd0' ), None )
+        self.host.cmd( 'ip addr add 10.0.0.3/8 dev d0' )
+        self.assertEqual( self.host.IP( 'd0' ), '10.0.0.3' )
+
+    def testConfigureFailure( self ):
+        "Addresses configure() failed to apply aren't cached"
+        output = self.host.configure( ips={ 'd0': ( '10.0.0.4', 8 ),
+                                            'nosuch': ( '10.0.0.5', 8 ) },
+                                      macs={ 'nosuch': '00:00:00:00:00:05' } )
+        self.assertTrue( 'Command failed' in output )
+        self.assertEqual( self.host.IP( 'd0' ), '10.0.0.4' )
+        self.assertFalse( 'nosuch' in self.host.ips )
+        self.assertFalse( 'nosuch' in self.host.macs )
+        self.assertEqual( self.host.IP( 'nosuch' ), None )
+
+
+class testConfigure( unittest.TestCase ):
+    "Test Node.configure()."
+
+    def setUp( self ):
+        self.host = Host( 'h1' )
+        self.host.cmd( 'ip link add d0 type veth peer name d1' )
+
+    def tearDown( self ):
+        self.host.terminate()
+
+    def testAddrs( self ):
+        "Addresses are applied, and interfaces given them brought up"
+        self.host.configure( ips={ 'd0': ( '10.0.0.1', 24 ) },
+                             macs={ 'd0': '00:00:00:00:00:01' },
+                             up=[ 'lo' ] )
+        output = self.host.cmd( 'ip addr show d0' )
+        self.assertTrue( 'inet 10.0.0.1/24' in output )
+        self.assertTrue( '00:00:00:00:00:01' in output )
+        self.assertTrue( 'UP' in self.host.cmd( 'ip link show lo' ) )
+        self.host.invalidateAddrs()
+        self.assertEqual( self.host.IP( 'd0' ), '10.0.0.1' )
+        self.assertEqual( self.host.MAC( 'd0' ), '00:00:00:00:00:01' )
+
+    def testRoutes( self ):
+        "Default and host routes are added"
+        self.host.configure( ips={ 'd0': ( '10.0.0.1', 24 ) },
+                             defaultRoute='d0',
+                             hostRoutes={ '10.9.9.9': 'd0' } )
+        routes = self.host.cmd( 'ip route' )
+        self.assertTrue( 'default dev d0' in routes )
+        self.assertTrue( '10.9.9.9 dev d0' in routes )
+
+    def testDown( self ):
+        "Interfaces may be brought down"
+        self.host.configure( up=[ 'd0' ] )
+        self.assertTrue( self.host.intfIsUp( 'd0' ) )
+        self.host.configure( down=[ 'd0' ] )
+        self.assertFalse( self.host.intfIsUp( 'd0' ) )
+
+    def testPriority( self ):
+        "priority renices the node's shell"
+        self.assertEqual( self.host.configure(), '' )
+        self.host.configure( priority=5 )
+        nice = self.host.cmd( 'ps -o ni= -p %d' % self.host.pid )
+        self.assertEqual( int( nice.split()[ 0 ] ), 5 )
+
+
+class FramedHost( Host ):
+    "Host which runs the framed node agent rather than a shell."
+    framed = True
+
+
+class testFramed( unittest.TestCase ):
+    "Test nodes which talk to mininet/agent.py."
+
+    def setUp( self ):
+        self.host = FramedHost( 'h1' )
+
+    def tearDown( self ):
+        self.host.terminate()
+
+    def testCmd( self ):
+        "Commands return their output and exit status"
+        self.assertEqual( self.host.cmd( 'echo hello; exit 3' ), 'hello\n' )
+        self.assertEqual( self.host.lastStatus, 3 )
+        self.assertTrue( self.host.lastPid > 0 )
+
+    def testBinaryOutput( self ):
+        "Output may contain anything, including our shell markers"
+        output = self.host.cmd( "printf '\\001\\002\\003\\177\\000x'" )
+        self.assertEqual( output, '\001\002\003\177\000x' )
+
+    def testNamespace( self ):
+        "Commands run in the node's network namespace"
+        output = self.host.cmd( 'ip link' )
+        self.assertTrue( 'lo:' in output )
+        self.assertFalse( 'eth0' in output )
+
+    def testTimeout( self ):
+        "A command which takes too long is interrupted"
+        output = self.host.cmd( 'sleep 30', timeoutms=300 )
+        self.assertTrue( isinstance( output, TimedOut ) )
+        self.assertEqual( self.host.cmd( 'echo ok' ), 'ok\n' )
+
+
+class testLinks( unittest.TestCase ):
+    "Test creating and deleting links between real nodes."
+
+    def setUp( self ):
+        self.root = Node( 'r0', inNamespace=False )
+        self.host = Host( 'h1' )
+
+    def tearDown( self ):
+        self.root.deleteIntfs()
+        self.host.terminate()
+        self.root.terminate()
+
+    def inNode( self, node, intf ):
+        "Is intf in node's namespace (and not the root namespace)?"
+        return ( 'does not exist' not in node.cmd( 'ip link show', intf ) and
+                 not intfInRoot( intf ) )
+
+    def testPlacement( self ):
+        "Each end of a link is in its node's namespace"
+        intf1, intf2 = self.root.linkTo( self.host )
+        self.assertTrue( intfInRoot( intf1 ) )
+        self.assertTrue( self.inNode( self.host, intf2 ) )
+
+    def testNewHosts( self ):
+        "Links to hosts whose shells have only just started are placed"
+        for i in range( 10 ):
+            h1, h2 = Host( 'h%da' % i ), Host( 'h%db' % i )
+            try:
+                intf1, intf2 = h1.linkTo( h2 )
+                self.assertTrue( self.inNode( h1, intf1 ) )
+                self.assertTrue( self.inNode( h2, intf2 ) )
+            finally:
+                h1.terminate()
+                h2.terminate()
+
+    def testDeleteOwnIntfsOnly( self ):
+        "deleteIntfs() leaves interfaces the node didn't create alone"
+        quietRun( 'ip link add mnvx0 type veth peer name mnvx1' )
+        try:
+            self.root.linkTo( self.host )
+            self.root.MAC( 'mnvx0' )
+            self.root.setIP( 'mnvx0', '10.99.0.1' )
+            self.root.deleteIntfs()
+            self.assertTrue( intfInRoot( 'mnvx0' ) )
+            self.assertFalse( intfInRoot( 'r0-eth0' ) )
+        finally:
+            quietRun( 'ip link del mnvx0' )
+
+    def testPortReuse( self ):
+        "Deleted ports are reused, lowest first"
+        for _ in range( 4 ):
+            self.root.linkTo( self.host )
+        self.assertEqual( sorted( self.root.intfs ), [ 0, 1, 2, 3 ] )
+        self.root.deletePort( 2 )
+        self.root.deletePort( 1 )
+        self.assertEqual( self.root.newPort(), 1 )
+        self.root.linkTo( self.host )
+        self.assertEqual( self.root.newPort(), 2 )
+        self.root.linkTo( self.host )
+        self.assertEqual( self.root.newPort(), 4 )
+        self.assertEqual( len( self.root.connectionsTo( self.host ) ), 4 )
+
+
+class testSpawner( unittest.TestCase ):
+    "Test starting node shells from a fork server."
+
+    def setUp( self ):
+        self.spawner = Spawner()
+
+    def tearDown( self ):
+        self.spawner.stop()
+
+    def testHosts( self ):
+        "Spawned shells run commands, each in its own namespace"
+        hosts = [ Host( 'h%d' % i, spawner=self.spawner, waitStart=False )
+                  for i in range( 3 ) ]
+        try:
+            for host in hosts:
+                host.waitStarted()
+                self.assertEqual( host.shell, None )
+                self.assertTrue( 'ok' in host.cmd( 'echo ok' ) )
+            hosts[ 0 ].linkTo( hosts[ 1 ] )
+            self.assertTrue( 'h0-eth0' in hosts[ 0 ].cmd( 'ip link' ) )
+            self.assertFalse( 'h0-eth0' in hosts[ 2 ].cmd( 'ip link' ) )
+        finally:
+            for host in hosts:
+                host.terminate()
+
+    def testStopped( self ):
+        "Shells outlive the server, which other nodes don't use"
+        host = Host( 'h1', spawner=self.spawner )
+        self.spawner.stop()
+        try:
+            self.assertTrue( 'ok' in host.cmd( 'echo ok' ) )
+            other = Host( 'h2' )
+            self.assertEqual( other.spawner, None )
+            self.assertTrue( other.shell )
+            other.terminate()
+        finally:
+            host.terminate()
+        self.spawner = Spawner()
+
+
+class testRootHelper( unittest.TestCase ):
+    "Test RootHelper, pretending not to be root so that it starts."
+
+    def setUp( self ):
+        self.geteuid = os.geteuid
+        os.geteuid = lambda: 1000
+
+    def tearDown( self ):
+        os.geteuid = self.geteuid
+        while RootHelper.helper:
+            RootHelper.stop()
+
+    def testRun( self ):
+        "quietRun() goes through the helper, which runs commands as root"
+        helper = RootHelper.start()
+        self.assertTrue( helper is RootHelper.helper )
+        self.assertEqual( quietRun( 'id -u' ), '0\n' )
+        self.assertEqual( quietRun( [ 'sh', '-c', 'echo "a  b" >&2' ] ),
+                          'a  b\n' )
+
+    def testShared( self ):
+        "The helper keeps running until its last user stops"
+        helper = RootHelper.start()
+        self.assertTrue( RootHelper.start() is helper )
+        RootHelper.stop()
+        self.assertTrue( helper.alive() )
+        self.assertEqual( quietRun( 'echo ok' ), 'ok\n' )
+        RootHelper.stop()
+        self.assertFalse( helper.alive() )
+        self.assertEqual( RootHelper.helper, None )
+
+    def testRestart( self ):
+        "A helper which has died is replaced by the next start()"
+        helper = RootHelper.start()
+        helper.popen.kill()
+        helper.popen.wait()
+        self.assertEqual( quietRun( 'echo ok' ), 'ok\n' )
+        other = RootHelper.start()
+        self.assertFalse( other is helper )
+        self.assertTrue( other.alive() )
+        RootHelper.stop()
+
+
+if __name__ == '__main__':
+    setLogLevel( 'warning' )
+    unittest.main()
@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+
+"""Package: mininet
+   Test utility code which needs neither root nor a network: output
+   buffering, waiting for fds, coroutines and worker threads, netlink
+   messages, and the framing used by the node agent."""
+
+import os
+import socket
+import struct
+import threading
+import unittest
+from time import sleep
+
+from mininet.util import ReadBuffer, Reactor, reactor, runCoroutines
+from mininet.util import WaitFd, runThreads, Netlink
+from mininet.agent import packFrame, parseFrames
+
+
+class testReadBuffer( unittest.TestCase ):
+    "Test ReadBuffer."
+
+    def testRead( self ):
+        "Reads return data in order, up to the requested size"
+        buf = ReadBuffer()
+        buf.append( 'hello ' )
+        buf.append( 'world' )
+        self.assertEqual( len( buf ), 11 )
+        self.assertEqual( buf.read( 3 ), 'hel' )
+        self.assertEqual( buf.read( 100 ), 'lo world' )
+        self.assertEqual( len( buf ), 0 )
+        self.assertEqual( buf.read( 10 ), '' )
+
+    def testReadline( self ):
+        "Lines are returned once complete, without their newlines"
+        buf = ReadBuffer()
+        buf.append( 'one\ntw' )
+        self.assertEqual( buf.readline(), 'one' )
+        self.assertEqual( buf.readline(), None )
+        buf.append( 'o\n' )
+        self.assertEqual( buf.readline(), 'two' )
+        self.assertEqual( len( buf ), 0 )
+
+    def testCompaction( self ):
+        "Consumed data is discarded without losing unread data"
+        buf = ReadBuffer()
+        data = ''.join( '%05d\n' % i for i in range( 10000 ) )
+        buf.append( data )
+        lines = [ buf.readline() for _ in range( 6000 ) ]
+        self.assertTrue( len( buf.buf ) < len( data ) )
+        self.assertEqual( len( buf ), 4000 * 6 )
+        line = buf.readline()
+        while line is not None:
+            lines.append( line )
+            line = buf.readline()
+        self.assertEqual( lines, [ '%05d' % i for i in range( 10000 ) ] )
+
+
+class testReactor( unittest.TestCase ):
+    "Test Reactor."
+
+    def setUp( self ):
+        self.reactor = Reactor()
+
+    def testReady( self ):
+        "Only readable fds are returned"
+        r1, w1 = os.pipe()
+        r2, w2 = os.pipe()
+        os.write( w2, 'x' )
+        self.assertEqual( self.reactor.poll( [ r1, r2 ], 0 ), [ r2 ] )
+        self.assertEqual( self.reactor.poll( [ r1 ], 0 ), [] )
+        self.assertTrue( self.reactor.waitFd( r2, 0 ) )
+        self.assertFalse( self.reactor.waitFd( r1, 0 ) )
+        for fd in r1, w1, r2, w2:
+            os.close( fd )
+
+    def testRegistered( self ):
+        "Only fds added or removed since the last wait are updated"
+        r1, w1 = os.pipe()
+        r2, w2 = os.pipe()
+        self.reactor.poll( [ r1, r2 ], 0 )
+        self.assertEqual( self.reactor.registered, set( [ r1, r2 ] ) )
+        self.reactor.poll( [ r2 ], 0 )
+        self.assertEqual( self.reactor.registered, set( [ r2 ] ) )
+        os.write( w1, 'x' )
+        self.assertEqual( self.reactor.poll( [ r1, r2 ], 0 ), [ r1 ] )
+        for fd in r1, w1, r2, w2:
+            self.reactor.forget( fd )
+            os.close( fd )
+
+    def testReusedFd( self ):
+        "An fd forgotten, closed and reused is waited on afresh"
+        r, w = os.pipe()
+        self.assertEqual( self.reactor.poll( [ r ], 0 ), [] )
+        self.reactor.forget( r )
+        os.close( r )
+        os.close( w )
+        r2, w2 = os.pipe()
+        self.assertEqual( r2, r )
+        os.write( w2, 'x' )
+        self.assertEqual( self.reactor.poll( [ r2 ], 1000 ), [ r2 ] )
+        os.close( r2 )
+        os.close( w2 )
+
+    def testClosedFd( self ):
+        "A closed fd left registered doesn't break later waits"
+        r, w = os.pipe()
+        closed = os.dup2( r, 900 ) or 900
+        self.reactor.poll( [ closed ], 0 )
+        os.close( closed )
+        os.write( w, 'x' )
+        self.assertEqual( self.reactor.poll( [ r ], 0 ), [ r ] )
+        self.reactor.forget( r )
+        os.close( r )
+        os.close( w )
+
+
+class testCoroutines( unittest.TestCase ):
+    "Test runCoroutines()."
+
+    def setUp( self ):
+        self.fds = []
+
+    def tearDown( self ):
+        for fd in self.fds:
+            reactor.forget( fd )
+            os.close( fd )
+
+    def pipe( self ):
+        "Return a new pipe, closed after the test."
+        r, w = os.pipe()
+        self.fds += [ r, w ]
+        return r, w
+
+    def testResults( self ):
+        "Results are returned in order, whatever order fds become ready"
+        pipes = [ self.pipe() for _ in range( 3 ) ]
+
+        def reader( fd ):
+            "Wait for fd, then read from it."
+            yield WaitFd( fd )
+            yield os.read( fd, 100 )
+
+        def nested( fd ):
+            "Run reader() as a sub-coroutine."
+            data = yield reader( fd )
+            yield data.upper()
+
+        for r, w in reversed( pipes ):
+            os.write( w, 'data%d' % r )
+        coroutines = [ reader( pipes[ 0 ][ 0 ] ), nested( pipes[ 1 ][ 0 ] ),
+                       reader( pipes[ 2 ][ 0 ] ) ]
+        results = runCoroutines( coroutines )
+        self.assertEqual( results, [ 'data%d' % pipes[ 0 ][ 0 ],
+                                     ( 'data%d' % pipes[ 1 ][ 0 ] ).upper(),
+                                     'data%d' % pipes[ 2 ][ 0 ] ] )
+
+    def testSharedFd( self ):
+        "Every coroutine waiting on an fd is resumed"
+        r, w = self.pipe()
+
+        def waiter( name ):
+            "Wait for r without reading it."
+            yield WaitFd( r )
+            yield name + '-done'
+
+        os.write( w, 'x' )
+        self.assertEqual( runCoroutines( [ waiter( 'a' ), waiter( 'b' ) ] ),
+                          [ 'a-done', 'b-done' ] )
+
+    def testIntResults( self ):
+        "Yielded numbers (e.g. exit statuses) are results, not fds"
+        def status( value ):
+            "Return value as our result."
+            yield value
+        self.assertEqual( runCoroutines( [ status( 0 ), status( 7 ),
+                                           status( True ) ] ),
+                          [ 0, 7, True ] )
+
+    def testNone( self ):
+        "A coroutine which just finishes has a result of None"
+        def finish():
+            "Finish without yielding a result."
+            return
+            yield
+        self.assertEqual( runCoroutines( [ finish() ] ), [ None ] )
+
+
+class testFrames( unittest.TestCase ):
+    "Test the node agent's frame format."
+
+    def testRoundTrip( self ):
+        "Frames are parsed back into their types and payloads"
+        data = packFrame( 'C', 'echo hi' ) + packFrame( 'I' ) + \
+            packFrame( 'O', '\0\xff\n' )
+        frames, rest = parseFrames( data )
+        self.assertEqual( frames, [ ( 'C', 'echo hi' ), ( 'I', '' ),
+                                    ( 'O', '\0\xff\n' ) ] )
+        self.assertEqual( rest, '' )
+
+    def testPartial( self ):
+        "Incomplete frames are left for later"
+        data = packFrame( 'O', 'hello' ) + packFrame( 'X', '0' )
+        for cut in range( len( data ) ):
+            frames, rest = parseFrames( data[ :cut ] )
+            more, rest = parseFrames( rest + data[ cut: ] )
+            self.assertEqual( frames + more, [ ( 'O', 'hello' ),
+                                               ( 'X', '0' ) ] )
+            self.assertEqual( rest, '' )
+
+
+class testThreads( unittest.TestCase ):
+    "Test runThreads()."
+
+    def testAllCalled( self ):
+        "Every item is processed once, by at most maxThreads threads"
+        lock = threading.Lock()
+        state = { 'running': 0, 'most': 0 }
+        done = []
+
+        def work( item ):
+            "Record concurrency while sleeping briefly."
+            with lock:
+                state[ 'running' ] += 1
+                state[ 'most' ] = max( state[ 'most' ], state[ 'running' ] )
+            sleep( .01 )
+            with lock:
+                state[ 'running' ] -= 1
+                done.append( item )
+
+        self.assertEqual( runThreads( work, range( 20 ), maxThreads=4 ), [] )
+        self.assertEqual( sorted( done ), range( 20 ) )
+        self.assertTrue( 1 < state[ 'most' ] <= 4 )
+
+    def testFailures( self ):
+        "Failures (including exit()) are reported per item"
+        def work( item ):
+            "Fail for some items."
+            if item == 2:
+                raise Exception( 'two' )
+            if item == 3:
+                raise SystemExit( 1 )
+        failures = runThreads( work, range( 5 ) )
+        self.assertEqual( sorted( item for item, _e in failures ), [ 2, 3 ] )
+        for item, e in failures:
+            if item == 2:
+                self.assertEqual( str( e ), 'two' )
+            else:
+                self.assertTrue( isinstance( e, SystemExit ) )
+
+
+class FakeSocket( object ):
+    "Netlink socket which records requests and acknowledges them."
+
+    def __init__( self, err=0 ):
+        self.sent = []
+        self.err = err
+
+    def sendall( self, data ):
+        self.sent.append( data )
+
+    def recv( self, _size ):
+        _len, _kind, _flags, seq, _pid = struct.unpack_from( '=IHHII',
+                                                            self.sent[ -1 ] )
+        # NLMSG_ERROR carrying -errno, followed by the request header
+        return struct.pack( '=IHHIIi', 36, Netlink.NLMSG_ERROR, 0, seq, 0,
+                            -self.err ) + self.sent[ -1 ][ :16 ]
+
+
+def makeNetlink( err=0 ):
+    "Return a Netlink client which talks to a FakeSocket."
+    nl = Netlink.__new__( Netlink )
+    nl.sock = FakeSocket( err )
+    nl.seq = 0
+    nl.lock = threading.Lock()
+    return nl
+
+
+def parseAttrs( data ):
+    "Parse netlink attributes into a list of ( type, payload )."
+    attrs = []
+    while len( data ) >= 4:
+        size, kind = struct.unpack_from( '=HH', data )
+        attrs.append( ( kind, data[ 4:size ] ) )
+        data = data[ ( size + 3 ) & ~3: ]
+    return attrs
+
+
+class testNetlink( unittest.TestCase ):
+    "Test construction of netlink messages."
+
+    def testAttr( self ):
+        "Attributes have a length and type, and are padded to 4 bytes"
+        attr = Netlink.attr( Netlink.IFLA_IFNAME, 'eth0\0' )
+        self.assertEqual( len( attr ), 12 )
+        self.assertEqual( struct.unpack_from( '=HH', attr ),
+                          ( 9, Netlink.IFLA_IFNAME ) )
+        self.assertEqual( attr[ 4:9 ], 'eth0\0' )
+
+    def testLinkAttrs( self ):
+        "Links are named, and placed in a namespace if a pid is given"
+        data = Netlink.linkAttrs( 'h1-eth0', 1234 )
+        family = struct.unpack_from( '=B', data )[ 0 ]
+        self.assertEqual( family, socket.AF_UNSPEC )
+        attrs = dict( parseAttrs( data[ 16: ] ) )
+        self.assertEqual( attrs[ Netlink.IFLA_IFNAME ], 'h1-eth0\0' )
+        self.assertEqual( struct.unpack( '=I',
+                                         attrs[ Netlink.IFLA_NET_NS_PID ] ),
+                          ( 1234, ) )
+        attrs = dict( parseAttrs( Netlink.linkAttrs( 's1-eth1' )[ 16: ] ) )
+        self.assertFalse( Netlink.IFLA_NET_NS_PID in attrs )
+
+    def testAddVethPair( self ):
+        "A veth pair request names both ends and is acknowledged"
+        nl = makeNetlink()
+        self.assertEqual( nl.addVethPair( 's1-eth1', 'h1-eth0', None, 42 ),
+                          0 )
+        msg = nl.sock.sent[ 0 ]
+        size, kind, flags, seq, _pid = struct.unpack_from( '=IHHII', msg )
+        self.assertEqual( size, len( msg ) )
+        self.assertEqual( kind, Netlink.RTM_NEWLINK )
+        for flag in ( Netlink.NLM_F_REQUEST, Netlink.NLM_F_ACK,
+                      Netlink.NLM_F_CREATE, Netlink.NLM_F_EXCL ):
+            self.assertTrue( flags & flag )
+        self.assertEqual( seq, 1 )
+        attrs = dict( parseAttrs( msg[ 32: ] ) )
+        self.assertEqual( attrs[ Netlink.IFLA_IFNAME ], 's1-eth1\0' )
+        linkinfo = dict( parseAttrs( attrs[ Netlink.IFLA_LINKINFO ] ) )
+        self.assertEqual( linkinfo[ Netlink.IFLA_INFO_KIND ], 'veth' )
+        peer = dict( parseAttrs( linkinfo[ Netlink.IFLA_INFO_DATA ] ) )
+        peerAttrs = dict( parseAttrs( peer[ Netlink.VETH_INFO_PEER ][ 16: ] ) )
+        self.assertEqual( peerAttrs[ Netlink.IFLA_IFNAME ], 'h1-eth0\0' )
+        self.assertEqual( struct.unpack( '=I', peerAttrs[
+            Netlink.IFLA_NET_NS_PID ] ), ( 42, ) )
+
+    def testErrors( self ):
+        "Failed requests return their errno"
+        nl = makeNetlink( err=19 )
+        self.assertEqual( nl.deleteLink( 'h1-eth0' ), 19 )
+        self.assertEqual( nl.deleteLink( 'h1-eth1' ), 19 )
+        _size, kind, _flags, seq, _pid = struct.unpack_from(
+            '=IHHII', nl.sock.sent[ 1 ] )
+        self.assertEqual( ( kind, seq ), ( Netlink.RTM_DELLINK, 2 ) )
+
+    def testHasLink( self ):
+        "Links are looked up by name"
+        self.assertTrue( makeNetlink().hasLink( 'h1-eth0' ) )
+        nl = makeNetlink( err=19 )
+        self.assertFalse( nl.hasLink( 'h1-eth0' ) )
+        _size, kind, _flags, _seq, _pid = struct.unpack_from(
+            '=IHHII', nl.sock.sent[ 0 ] )
+        self.assertEqual( kind, Netlink.RTM_GETLINK )
+
+
+if __name__ == '__main__':
+    unittest.main()
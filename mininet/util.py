@@ -1,11 +1,21 @@
 "Utility functions for Mininet."
 
 from time import sleep
+from pipes import quote
 from resource import setrlimit, RLIMIT_NPROC, RLIMIT_NOFILE
 import select
 from subprocess import call, check_call, Popen, PIPE, STDOUT
+from types import GeneratorType
+import errno
 import os
+import re
+import signal
+import socket
+import struct
+import sys
+import threading
 
+from mininet.agent import packFrame, parseFrames
 from mininet.log import error
 
 # Command execution support
@@ -23,6 +33,14 @@ def checkRun( cmd ):
 # pylint doesn't understand explicit type checking
 # pylint: disable-msg=E1103
 
+def rootCmd( cmd ):
+    """Return a command line which runs cmd as root, using sudo
+       unless we are root already.
+       cmd: list of command params"""
+    if os.geteuid() == 0:
+        return cmd
+    return [ 'sudo', '-E', 'env', 'PATH=%s' % os.environ[ 'PATH' ] ] + cmd
+
 def quietRun( *cmd ):
     """Run a command, routing stderr to stdout, and return the output.
        cmd: list of command params"""
@@ -30,32 +48,363 @@ def quietRun( *cmd ):
         cmd = cmd[ 0 ]
         if isinstance( cmd, str ):
             cmd = cmd.split()
-    cmd = ["sudo", "-E", "env", "PATH=%s" % os.environ["PATH"]] + cmd
-    popen = Popen( cmd, stdout=PIPE, stderr=STDOUT )
+    helper = RootHelper.helper
+    if helper and helper.alive():
+        return helper.run( cmd )
+    popen = Popen( rootCmd( cmd ), stdout=PIPE, stderr=STDOUT )
     # We can't use Popen.communicate() because it uses
-    # select(), which can't handle
-    # high file descriptor numbers! poll() can, however.
-    output = ''
-    readable = select.poll()
-    readable.register( popen.stdout )
+    # select(), which can't handle high file descriptor numbers!
+    # Blocking reads until EOF don't care, however.
+    output = []
     while True:
-        while readable.poll():
-            data = popen.stdout.read( 1024 )
-            if len( data ) == 0:
-                break
-            output += data
-        popen.poll()
-        if popen.returncode != None:
+        data = Reactor.retry( os.read, popen.stdout.fileno(), 65536 )
+        if not data:
             break
-    return output
+        output.append( data )
+    Reactor.retry( popen.wait )
+    popen.stdout.close()
+    return ''.join( output )
+
+def killProcess( pid, sig=signal.SIGTERM, group=False ):
+    """Send a signal to a process (such as a node's shell) directly,
+       falling back to kill(1) as root if we aren't allowed to.
+       pid: process id
+       sig: signal number
+       group: signal pid's process group rather than just pid?"""
+    try:
+        if group:
+            os.killpg( pid, sig )
+        else:
+            os.kill( pid, sig )
+    except OSError, e:
+        if e.errno == errno.EPERM:
+            target = '-%d' % pid if group else str( pid )
+            quietRun( 'kill -%d -- %s' % ( sig, target ) )
+        elif e.errno != errno.ESRCH:
+            raise
+
+def childProcesses( ppid ):
+    """Return the children of a process, by scanning /proc.
+       ppid: parent process id
+       returns: list of ( pid, process group id )"""
+    children = []
+    for entry in os.listdir( '/proc' ):
+        if not entry.isdigit():
+            continue
+        try:
+            with open( '/proc/%s/stat' % entry ) as f:
+                stat = f.read()
+        except IOError:
+            continue  # exited
+        # pid (comm) state ppid pgrp ..., where comm may contain anything
+        fields = stat[ stat.rfind( ')' ) + 2: ].split()
+        if int( fields[ 1 ] ) == ppid:
+            children.append( ( int( entry ), int( fields[ 2 ] ) ) )
+    return children
+
+class RootHelper( object ):
+    """Long-lived root process which runs commands for quietRun(), so
+       that we pay for sudo and its exec chain once rather than on every
+       call. This is only worthwhile if we are not root ourselves.
+       It speaks the framed protocol of mininet/agent.py.
+       A single helper is shared by everything in the process which
+       has called start(), and is shut down once all of them have
+       called stop()."""
+
+    helper = None  # running helper used by quietRun(), if any
+    users = 0  # number of start() calls not yet matched by stop()
+
+    def __init__( self ):
+        agent = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ),
+                              'agent.py' )
+        self.popen = Popen( rootCmd( [ sys.executable, agent ] ),
+                            stdin=PIPE, stdout=PIPE )
+        self.buf = ''
+        self.lock = threading.Lock()  # one command at a time
+
+    @classmethod
+    def start( cls ):
+        """Start a helper (if we aren't root) and route quietRun() to
+           it, or share the one already running, restarting it if it
+           has died. Each call should be matched by a call to stop().
+           returns: helper, or None if we are root"""
+        if os.geteuid() == 0:
+            return None
+        if cls.helper and not cls.helper.alive():
+            cls.helper.shutdown()
+            cls.helper = None
+        if cls.helper is None:
+            cls.helper = cls()
+        cls.users += 1
+        return cls.helper
+
+    @classmethod
+    def stop( cls ):
+        "Release the helper, shutting it down if nobody else uses it."
+        cls.users = max( cls.users - 1, 0 )
+        if cls.users == 0 and cls.helper:
+            helper, cls.helper = cls.helper, None
+            helper.shutdown()
+
+    def alive( self ):
+        "Is our process still running?"
+        return self.popen.poll() is None
+
+    def shutdown( self ):
+        "Close our pipes to the helper and wait for it to exit."
+        self.popen.stdin.close()
+        Reactor.retry( self.popen.wait )
+        self.popen.stdout.close()
+
+    def run( self, cmd ):
+        """Run a command as root and return its output.
+           cmd: list of command params"""
+        request = packFrame( 'C', ' '.join( quote( arg ) for arg in cmd ) )
+        output = []
+        with self.lock:
+            os.write( self.popen.stdin.fileno(), request )
+            while True:
+                data = Reactor.retry( os.read, self.popen.stdout.fileno(),
+                                      65536 )
+                if not data:
+                    raise Exception( 'root helper exited' )
+                frames, self.buf = parseFrames( self.buf + data )
+                for kind, payload in frames:
+                    if kind == 'O':
+                        output.append( payload )
+                    elif kind == 'X':
+                        return ''.join( output )
 
 # pylint: enable-msg=E1103
+
+# Waiting for output
+#
+# A single Reactor is shared by all nodes in the process. It keeps one
+# epoll object holding whichever set of fds was last waited on, so that
+# loops which repeatedly wait on the same nodes (monitoring, the CLI,
+# coroutines) only make system calls for the fds which were added or
+# removed since the previous wait. This means we trust that an fd we
+# registered is still the file we registered, so code which closes a
+# file that may have been waited on should call forget() first (as
+# Node.closeFiles() does); otherwise its number may be reused for a new
+# file which we never register.
+# Waiting on a single fd uses a reusable poll object instead, which
+# costs a single system call and leaves the epoll set alone. Each
+# thread gets its own, so that threads driving different nodes (e.g.
+# when starting switches in parallel) can wait at the same time.
+
+class Reactor( object ):
+    "Readiness multiplexer for node (and other) file descriptors."
+
+    def __init__( self ):
+        self.epoll = select.epoll()
+        self.registered = set()  # fds we last registered with epoll
+        self.local = threading.local()  # per-thread poll for waitFd
+
+    @staticmethod
+    def retry( fn, *args ):
+        "Call fn( *args ), retrying if interrupted by a signal."
+        while True:
+            try:
+                return fn( *args )
+            except ( IOError, OSError, select.error ), e:
+                if e.args[ 0 ] != errno.EINTR:
+                    raise
+
+    def poll( self, fds, timeoutms=None ):
+        """Wait until any of a set of fds is readable.
+           fds: iterable of file descriptors
+           timeoutms: timeout in ms, or None/negative to wait indefinitely
+           returns: list of readable (or hung up) fds"""
+        fds = set( fds )
+        for fd in self.registered - fds:
+            self.unregister( fd )
+        self.registered &= fds
+        self.register( fds - self.registered )
+        if timeoutms is None or timeoutms < 0:
+            timeout = -1
+        else:
+            timeout = timeoutms / 1000.0
+        ready = [ fd for fd, _mask in self.retry( self.epoll.poll, timeout ) ]
+        if not fds.issuperset( ready ):
+            # An fd was closed without forget() while another fd (e.g.
+            # in a child process) still refers to its file, so epoll
+            # still watches it and we can no longer remove it. Start
+            # afresh, and check again without waiting.
+            self.epoll.close()
+            self.epoll = select.epoll()
+            self.registered = set()
+            self.register( fds )
+            ready = [ fd for fd, _mask in self.retry( self.epoll.poll, 0 ) ]
+        return ready
+
+    def register( self, fds ):
+        """Add fds to our epoll set, watching them for input.
+           fds: set of file descriptors"""
+        for fd in fds:
+            try:
+                self.epoll.register( fd, select.EPOLLIN )
+            except IOError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+                self.epoll.modify( fd, select.EPOLLIN )
+        self.registered |= fds
+
+    def unregister( self, fd ):
+        """Remove fd from our epoll set, ignoring the errors we get if
+           it has been closed or is no longer registered."""
+        try:
+            self.epoll.unregister( fd )
+        except IOError, e:
+            if e.errno not in ( errno.EBADF, errno.ENOENT ):
+                raise
+
+    def waitFd( self, fd, timeoutms=None ):
+        """Wait until a single fd is readable.
+           fd: file descriptor
+           timeoutms: timeout in ms or None to wait indefinitely
+           returns: True if fd is readable (or hung up)"""
+        single = getattr( self.local, 'single', None )
+        if single is None:
+            single = self.local.single = select.poll()
+        single.register( fd, select.POLLIN )
+        try:
+            return bool( self.retry( single.poll, timeoutms ) )
+        finally:
+            single.unregister( fd )
+
+    def forget( self, fd ):
+        """Drop fd from our registrations. Call this before closing an
+           fd which may have been passed to poll(), so that a new file
+           which reuses its number will be registered."""
+        if fd in self.registered:
+            self.unregister( fd )
+            self.registered.discard( fd )
+
+reactor = Reactor()
+
+# Cooperative multitasking, using generators as coroutines
+#
+# This allows a single thread to drive commands on many nodes at once,
+# e.g. runCoroutines( [ host.acmd( 'ifconfig' ) for host in hosts ] )
+# A coroutine may yield:
+#
+# - WaitFd( fd ): it is resumed once fd is readable. Several coroutines
+#   may wait on the same fd; all of them are resumed, so each should
+#   cope with finding nothing left to read.
+# - another coroutine: it is resumed with that coroutine's result
+# - anything else: this is its result, and it is closed
+#
+# A coroutine which simply finishes has a result of None.
+
+class WaitFd( object ):
+    "Yielded by a coroutine to wait until a file descriptor is readable."
+
+    __slots__ = ( 'fd', )
+
+    def __init__( self, fd ):
+        "fd: file descriptor"
+        self.fd = fd
+
+    def __repr__( self ):
+        return '<WaitFd %d>' % self.fd
+
+def runCoroutines( coroutines ):
+    """Run coroutines concurrently until they have all completed.
+       coroutines: list of generators
+       returns: list of results, in order"""
+    results = [ None ] * len( coroutines )
+    stacks = [ [ coro ] for coro in coroutines ]
+    waiting = {}  # fd -> indexes of coroutines waiting on it
+
+    def step( index, value=None ):
+        "Run coroutine index until it waits on an fd or completes."
+        stack = stacks[ index ]
+        while stack:
+            try:
+                yielded = stack[ -1 ].send( value )
+            except StopIteration:
+                stack.pop()
+                value = None
+                continue
+            if isinstance( yielded, WaitFd ):
+                waiting.setdefault( yielded.fd, [] ).append( index )
+                return
+            elif isinstance( yielded, GeneratorType ):
+                stack.append( yielded )
+                value = None
+            else:
+                stack.pop().close()
+                value = yielded
+        results[ index ] = value
+
+    for index in range( len( coroutines ) ):
+        step( index )
+    while waiting:
+        for fd in reactor.poll( waiting.keys() ):
+            for index in waiting.pop( fd ):
+                step( index )
+    return results
+
+# Worker threads
+#
+# Node operations which are mostly made of blocking commands (such as
+# starting a switch, which runs several ovs-vsctl/dpctl invocations)
+# can't easily be written as coroutines, so we run them in a bounded
+# pool of threads instead. Each node has its own shell, and the Reactor
+# gives each thread its own poll object, so threads may safely drive
+# different nodes at the same time.
+
+def runThreads( fn, items, maxThreads=16 ):
+    """Call fn( item ) for each item, using up to maxThreads threads,
+       and wait until all calls have completed.
+       fn: function of one argument
+       items: list of arguments
+       maxThreads: maximum number of concurrent calls
+       returns: list of ( item, exception ) for calls which failed"""
+    items = list( items )
+    pending = iter( items )
+    failures = []
+    lock = threading.Lock()
+
+    def worker():
+        "Call fn on items until none remain."
+        while True:
+            with lock:
+                item = next( pending, pending )
+            if item is pending:
+                return
+            try:
+                fn( item )
+            except ( Exception, SystemExit ), e:
+                with lock:
+                    failures.append( ( item, e ) )
+
+    if maxThreads <= 1 or len( items ) <= 1:
+        worker()
+        return failures
+    threads = [ threading.Thread( target=worker )
+                for _ in range( min( maxThreads, len( items ) ) ) ]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        # A join() without a timeout can't be interrupted by ^C
+        while thread.isAlive():
+            thread.join( .1 )
+    return failures
+
 # pylint: disable-msg=E1101,W0612
 
 def isShellBuiltin( cmd ):
-    "Return True if cmd is a bash builtin."
+    "Return True if cmd is a bash builtin or keyword (e.g. for, if.)"
     if isShellBuiltin.builtIns is None:
-        isShellBuiltin.builtIns = quietRun( 'bash -c enable' )
+        # Lines of the form 'enable name', then keywords one per line
+        isShellBuiltin.builtIns = frozenset(
+            line.split()[ -1 ]
+            for line in quietRun( [ 'bash', '-c', 'enable; compgen -k' ]
+                                  ).splitlines()
+            if line.strip() )
     space = cmd.find( ' ' )
     if space > 0:
         cmd = cmd[ :space]
@@ -65,6 +414,53 @@ isShellBuiltin.builtIns = None
 
 # pylint: enable-msg=E1101,W0612
 
+# Output buffering
+
+class ReadBuffer( object ):
+    """Growable byte buffer with offset-based consumption.
+       Appending is amortized O(1), and consumed data is only
+       discarded once it makes up most of the buffer, so reading
+       N bytes through the buffer costs O(N) overall."""
+
+    def __init__( self ):
+        self.buf = bytearray()
+        self.pos = 0  # offset of first unconsumed byte
+
+    def __len__( self ):
+        return len( self.buf ) - self.pos
+
+    def append( self, data ):
+        "Add data to the end of the buffer."
+        self.buf += data
+
+    def read( self, count ):
+        """Remove and return up to count bytes.
+           count: maximum number of bytes to return"""
+        end = min( self.pos + count, len( self.buf ) )
+        data = str( self.buf[ self.pos:end ] )
+        self.consume( end )
+        return data
+
+    def readline( self ):
+        """Remove and return a line.
+           returns: line (minus newline) or None"""
+        end = self.buf.find( '\n', self.pos )
+        if end < 0:
+            return None
+        line = str( self.buf[ self.pos:end ] )
+        self.consume( end + 1 )
+        return line
+
+    def consume( self, end ):
+        "Advance the read offset to end, compacting if worthwhile."
+        self.pos = end
+        if self.pos == len( self.buf ):
+            self.buf = bytearray()
+            self.pos = 0
+        elif self.pos > 4096 and self.pos * 2 > len( self.buf ):
+            del self.buf[ :self.pos ]
+            self.pos = 0
+
 # Interface management
 #
 # Interfaces are managed as strings which are simply the
@@ -78,17 +474,157 @@ isShellBuiltin.builtIns = None
 # live in the root namespace and thus do not have to be
 # explicitly moved.
 
-def makeIntfPair( intf1, intf2 ):
+# If we are root, links are managed by talking rtnetlink to the kernel
+# directly, which takes a few system calls rather than a sudo and ip(8)
+# process per operation, and lets us create each end of a veth pair
+# in its final namespace. Otherwise (or if netlink fails) we fall back
+# to ip(8).
+
+class Netlink( object ):
+    "Minimal rtnetlink client for creating and deleting links."
+
+    # Message types, flags and attributes from linux/(rt)netlink.h,
+    # linux/if_link.h and linux/veth.h
+    NLMSG_ERROR = 2
+    RTM_NEWLINK, RTM_DELLINK, RTM_GETLINK = 16, 17, 18
+    NLM_F_REQUEST, NLM_F_ACK = 1, 4
+    NLM_F_EXCL, NLM_F_CREATE = 0x200, 0x400
+    IFLA_IFNAME, IFLA_LINKINFO, IFLA_NET_NS_PID = 3, 18, 19
+    IFLA_INFO_KIND, IFLA_INFO_DATA = 1, 2
+    VETH_INFO_PEER = 1
+
+    def __init__( self ):
+        self.sock = socket.socket( socket.AF_NETLINK, socket.SOCK_RAW, 0 )
+        self.sock.bind( ( 0, 0 ) )
+        self.seq = 0
+        self.lock = threading.Lock()  # one request at a time
+
+    @staticmethod
+    def attr( kind, data ):
+        "Return a netlink attribute, padded to a multiple of 4 bytes."
+        size = 4 + len( data )
+        return struct.pack( '=HH', size, kind ) + data + \
+            '\0' * ( -size % 4 )
+
+    @classmethod
+    def linkAttrs( cls, name, pid=None ):
+        """Return an ifinfomsg naming a link, and placing it in the
+           network namespace of pid if given."""
+        data = struct.pack( '=BxHiII', socket.AF_UNSPEC, 0, 0, 0, 0 )
+        data += cls.attr( cls.IFLA_IFNAME, name + '\0' )
+        if pid is not None:
+            data += cls.attr( cls.IFLA_NET_NS_PID, struct.pack( '=I', pid ) )
+        return data
+
+    def request( self, kind, flags, body ):
+        """Send a request and wait for its acknowledgement.
+           returns: 0, or errno if the request failed"""
+        flags |= self.NLM_F_REQUEST | self.NLM_F_ACK
+        with self.lock:
+            self.seq += 1
+            header = struct.pack( '=IHHII', 16 + len( body ), kind, flags,
+                                  self.seq, 0 )
+            self.sock.sendall( header + body )
+            while True:
+                reply = Reactor.retry( self.sock.recv, 65536 )
+                pos = 0
+                while pos + 16 <= len( reply ):
+                    size, kind, _flags, seq, _pid = struct.unpack_from(
+                        '=IHHII', reply, pos )
+                    if kind == self.NLMSG_ERROR and seq == self.seq:
+                        err, = struct.unpack_from( '=i', reply, pos + 16 )
+                        return -err
+                    pos += ( size + 3 ) & ~3
+
+    def addVethPair( self, intf1, intf2, pid1=None, pid2=None ):
+        """Create a veth pair.
+           intf1, intf2: interface names
+           pid1, pid2: put each end in the namespace of this process
+           returns: 0, or errno if creation failed"""
+        peer = self.attr( self.VETH_INFO_PEER,
+                          self.linkAttrs( intf2, pid2 ) )
+        linkinfo = ( self.attr( self.IFLA_INFO_KIND, 'veth' ) +
+                     self.attr( self.IFLA_INFO_DATA, peer ) )
+        body = ( self.linkAttrs( intf1, pid1 ) +
+                 self.attr( self.IFLA_LINKINFO, linkinfo ) )
+        return self.request( self.RTM_NEWLINK,
+                             self.NLM_F_CREATE | self.NLM_F_EXCL, body )
+
+    def deleteLink( self, intf ):
+        """Delete a link in our namespace.
+           returns: 0, or errno (e.g. ENODEV) if deletion failed"""
+        return self.request( self.RTM_DELLINK, 0, self.linkAttrs( intf ) )
+
+    def hasLink( self, intf ):
+        "Return True if a link named intf exists in our namespace."
+        return not self.request( self.RTM_GETLINK, 0,
+                                 self.linkAttrs( intf ) )
+
+def netlink():
+    "Return our shared Netlink client, or None if we can't use netlink."
+    if netlink.client is None and os.geteuid() == 0:
+        try:
+            netlink.client = Netlink()
+        except socket.error:
+            netlink.client = False
+    return netlink.client or None
+
+netlink.client = None
+
+def deleteLink( intf ):
+    """Delete a link in the root namespace, along with its veth peer.
+       intf: string, interface"""
+    nl = netlink()
+    if not nl or nl.deleteLink( intf ) not in ( 0, errno.ENODEV ):
+        quietRun( 'ip link del ' + intf )
+
+def deleteLinks( intfs ):
+    """Delete a number of links in the root namespace, along with their
+       veth peers, using netlink if we can or else a single ip(8) batch.
+       intfs: list of interface names"""
+    nl = netlink()
+    if nl:
+        intfs = [ intf for intf in intfs
+                  if nl.deleteLink( intf ) not in ( 0, errno.ENODEV ) ]
+    if intfs:
+        quietRun( [ 'sh', '-c', "printf '%%s\\n' %s | ip -force -batch -" %
+                    ' '.join( quote( 'link del ' + intf )
+                              for intf in intfs ) ] )
+
+def intfInRoot( intf ):
+    """Check whether an interface is in the root namespace, e.g. because
+       makeIntfPair() failed to create it in a node's namespace.
+       intf: string, interface
+       returns: True if intf exists in the root namespace"""
+    nl = netlink()
+    if nl:
+        return nl.hasLink( intf )
+    return os.path.exists( '/sys/class/net/' + intf )
+
+def makeIntfPair( intf1, intf2, pid1=None, pid2=None ):
     """Make a veth pair connecting intf1 and intf2.
        intf1: string, interface
        intf2: string, interface
-       returns: success boolean"""
+       pid1, pid2: optional pids of processes whose namespaces should
+           hold intf1 and intf2
+       returns: True if the interfaces were created in the namespaces
+           of pid1 and pid2, False if they were created in the root
+           namespace and should be moved (e.g. with moveIntf())"""
+    nl = netlink()
+    if nl:
+        # Delete any old interfaces with the same names
+        for intf, pid in ( intf1, pid1 ), ( intf2, pid2 ):
+            if pid is None:
+                nl.deleteLink( intf )
+        if nl.addVethPair( intf1, intf2, pid1, pid2 ) == 0:
+            return True
     # Delete any old interfaces with the same names
     quietRun( 'ip link del ' + intf1 )
     quietRun( 'ip link del ' + intf2 )
     # Create new pair
     cmd = 'ip link add name ' + intf1 + ' type veth peer name ' + intf2
-    return quietRun( cmd )
+    quietRun( cmd )
+    return False
 
 def retry( retries, delaySecs, fn, *args, **keywords ):
     """Try something several times before giving up.
@@ -112,7 +648,8 @@ def moveIntfNoRetry( intf, node, printError=False ):
     cmd = 'ip link set ' + intf + ' netns ' + repr( node.pid )
     quietRun( cmd )
     links = node.cmd( 'ip link show' )
-    if not ( ' %s:' % intf ) in links:
+    # Newer ip(8) shows veths as name@peer:
+    if not re.search( r' %s[:@]' % re.escape( intf ), links ):
         if printError:
             error( '*** Error: moveIntf: ' + intf +
                 ' not successfully moved to ' + node.name + '\n' )
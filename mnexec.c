@@ -6,36 +6,200 @@
  *  - closing all file descriptors except stdin/out/error
  *  - detaching from a controlling tty using setsid
  *  - running in a network namespace
+ *  - running in the network namespace of an existing process
+ *  - running on a given set of CPUs
+ *  - running in a given control group
  *  - printing out the pid of a process so we can identify it later
+ *  - serving requests to start node shells, so that the cost of
+ *    starting mnexec (and sudo) is paid only once
  *
  * Partially based on public domain setsid(1)
 */
 
+#define _GNU_SOURCE
 #include <stdio.h>
-#include <linux/sched.h>
+#include <stdlib.h>
+#include <string.h>
+#include <dirent.h>
+#include <fcntl.h>
+#include <limits.h>
+#include <sched.h>
+#include <signal.h>
 #include <unistd.h>
 
 void usage(char *name) 
 {
     printf("Execution utility for Mininet.\n"
-           "usage: %s [-cdnp]\n"
+           "usage: %s [-cdnpf] [-a pid] [-s cpus] [-g cgroup]\n"
            "-c: close all file descriptors except stdin/out/error\n"
            "-d: detach from tty by calling setsid()\n"
            "-n: run in new network namespace\n"
-           "-p: print ^A + pid\n", name);
+           "-a pid: run in network namespace of process pid\n"
+           "-s cpus: run on cpus (list such as 0,2-3)\n"
+           "-g cgroup: run in cgroup (directory in cgroup filesystem)\n"
+           "-p: print ^A + pid, once the other options have taken effect\n"
+           "-f: fork server: start a shell for each request on stdin\n",
+           name);
+}
+
+/* Close file descriptors except stdin/out/error. We only visit
+ * descriptors which are actually open, since the fd limit may be
+ * very high. Fall back to trying all of them if /proc isn't there. */
+void closefds()
+{
+    DIR *dir;
+    struct dirent *entry;
+    int fd, dfd;
+
+    dir = opendir("/proc/self/fd");
+    if (dir == NULL) {
+        for (fd = getdtablesize(); fd > 2; fd--)
+            close(fd);
+        return;
+    }
+    dfd = dirfd(dir);
+    while ((entry = readdir(dir)) != NULL) {
+        fd = atoi(entry->d_name);
+        /* Closing fds doesn't disturb reading the directory */
+        if (fd > 2 && fd != dfd)
+            close(fd);
+    }
+    closedir(dir);
+}
+
+/* Set CPU affinity from a list such as 0,2-3 */
+int setaffinity(char *cpus)
+{
+    cpu_set_t set;
+    char *p = cpus, *end;
+    long first, last;
+
+    CPU_ZERO(&set);
+    while (*p) {
+        first = last = strtol(p, &end, 10);
+        if (end == p)
+            break;
+        if (*end == '-') {
+            p = end + 1;
+            last = strtol(p, &end, 10);
+            if (end == p)
+                break;
+        }
+        for (; first <= last; first++)
+            CPU_SET(first, &set);
+        p = end;
+        if (*p == ',')
+            p++;
+        else if (*p)
+            break;
+    }
+    if (*p) {
+        fprintf(stderr, "invalid cpu list: %s\n", cpus);
+        return -1;
+    }
+    if (sched_setaffinity(0, sizeof(set), &set) == -1) {
+        perror("sched_setaffinity");
+        return -1;
+    }
+    return 0;
+}
+
+/* Join a control group by writing our pid to its process list */
+int joincgroup(char *cgroup)
+{
+    char path[ PATH_MAX ];
+    FILE *f;
+
+    snprintf(path, sizeof(path), "%s/cgroup.procs", cgroup);
+    f = fopen(path, "w");
+    if (f == NULL) {
+        /* Older kernels only have the tasks file */
+        snprintf(path, sizeof(path), "%s/tasks", cgroup);
+        f = fopen(path, "w");
+    }
+    if (f == NULL) {
+        perror(path);
+        return -1;
+    }
+    fprintf(f, "%d\n", getpid());
+    if (fclose(f) == EOF) {
+        perror(path);
+        return -1;
+    }
+    return 0;
+}
+
+/* Start a shell on a pty for the fork server: detach into a new
+ * session, optionally unshare the network namespace, and make the
+ * pty slave our controlling tty and stdin/out/error. Called in the
+ * child; doesn't return. */
+void startshell(char *flags, char *tty)
+{
+    int fd;
+
+    signal(SIGCHLD, SIG_DFL);
+    setsid();
+    if (strchr(flags, 'n') && unshare(CLONE_NEWNET) == -1) {
+        perror("unshare");
+        exit(1);
+    }
+    fd = open(tty, O_RDWR);
+    if (fd == -1) {
+        perror(tty);
+        exit(1);
+    }
+    dup2(fd, 0);
+    dup2(fd, 1);
+    dup2(fd, 2);
+    closefds();
+    setenv("PS1", "\177", 1);
+    printf("\001%d\n", getpid());
+    fflush(stdout);
+    execlp("bash", "bash", "--norc", NULL);
+    perror("bash");
+    exit(1);
+}
+
+/* Fork server: for each request line "<flags> <pty slave path>" on
+ * stdin, start a shell (see startshell()) and reply with its pid,
+ * or 0 if we couldn't fork. The pty is opened by the requester, since
+ * it may not be able to receive file descriptors from us.
+ * Flags are '-' or 'n' (new network namespace.) */
+int forkserver()
+{
+    char line[ PATH_MAX + 32 ], flags[ 16 ], tty[ PATH_MAX ];
+    pid_t pid;
+
+    /* Shells are reaped automatically */
+    signal(SIGCHLD, SIG_IGN);
+    while (fgets(line, sizeof(line), stdin) != NULL) {
+        if (sscanf(line, "%15s %4095s", flags, tty) != 2) {
+            fprintf(stderr, "invalid request: %s", line);
+            printf("0\n");
+            fflush(stdout);
+            continue;
+        }
+        pid = fork();
+        if (pid == 0)
+            startshell(flags, tty);
+        printf("%d\n", pid == -1 ? 0 : pid);
+        fflush(stdout);
+    }
+    return 0;
 }
 
 int main(int argc, char *argv[])
 {
     char c;
     int fd;
+    char path[ 64 ];
+    int printpid = 0;
     
-    while ((c = getopt(argc, argv, "+cdnp")) != -1)
+    while ((c = getopt(argc, argv, "+cdnpfa:s:g:")) != -1)
         switch(c) {
         case 'c':
             /* close file descriptors except stdin/out/error */
-            for (fd = getdtablesize(); fd > 2; fd--)
-                close(fd);
+            closefds();
             break;
         case 'd':
             /* detach from tty */
@@ -59,16 +223,48 @@ int main(int argc, char *argv[])
                 return 1;
             }
             break;
+        case 'a':
+            /* run in network namespace of an existing process */
+            snprintf(path, sizeof(path), "/proc/%d/ns/net", atoi(optarg));
+            fd = open(path, O_RDONLY);
+            if (fd == -1) {
+                perror(path);
+                return 1;
+            }
+            if (setns(fd, CLONE_NEWNET) == -1) {
+                perror("setns");
+                return 1;
+            }
+            close(fd);
+            break;
+        case 's':
+            /* run on given cpus */
+            if (setaffinity(optarg) == -1)
+                return 1;
+            break;
+        case 'g':
+            /* run in given control group */
+            if (joincgroup(optarg) == -1)
+                return 1;
+            break;
         case 'p':
-            /* print pid */
-            printf("\001%d\n", getpid());
-            fflush(stdout);
+            /* print pid, but only once we are in our namespace etc.,
+             * since whoever reads it may act on that at once */
+            printpid = 1;
             break;
+        case 'f':
+            /* serve requests to start shells */
+            return forkserver();
         default:
             usage(argv[0]);
             break;
         }
 
+    if (printpid) {
+        printf("\001%d\n", getpid());
+        fflush(stdout);
+    }
+
     if (optind < argc) {
 		execvp(argv[optind], &argv[optind]);
 		perror(argv[optind]);